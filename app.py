@@ -1,5 +1,6 @@
 from flask import (
     Flask,
+    Request,
     render_template,
     request,
     redirect,
@@ -9,250 +10,3067 @@ from flask import (
     abort,
     Response,
     stream_with_context,
-    make_response
+    make_response,
+    send_file,
+    jsonify,
+    g,
+    has_request_context
 )
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from sqlalchemy import inspect, text
+from sqlalchemy import inspect, text, insert, update, tuple_, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+import click
 import tempfile
 import shutil
 import hashlib
-from datetime import datetime, timezone
+import gzip
+from datetime import datetime, timedelta, timezone
 from email.utils import parsedate_to_datetime
 from urllib.parse import quote
 import os
+import json
+import threading
+import queue
+import weakref
 import qrcode
+import qrcode.image.svg
 from io import BytesIO
-import base64
+import csv
+import io
+import zipfile
+import zlib
+import functools
+import math
+import sqlite3
+import time
+from collections import OrderedDict, namedtuple
 from functools import wraps
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 try:
     import fitz  # PyMuPDF
 except ImportError:
     fitz = None
 
+from PIL import Image
+
+try:
+    import redis
+except ImportError:  # Redis backend ixtiyoriy
+    redis = None
+
+try:
+    import brotli
+except ImportError:  # Brotli ixtiyoriy - bo'lmasa faqat gzip
+    brotli = None
+
 try:
     import pikepdf
 except ImportError:  # Render kabi muhitlarda build xatosi bo'lishi mumkin
     pikepdf = None
 
-# .env faylini yuklash
-load_dotenv()
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # S3 saqlash ixtiyoriy
+    boto3 = None
+    ClientError = None
+
+try:
+    import fcntl
+except ImportError:  # Windows - SQLite migratsiya qulfisiz ishlaydi
+    fcntl = None
+
+# .env faylini yuklash
+load_dotenv()
+
+app = Flask(
+    __name__,
+    instance_relative_config=True,
+    static_url_path='/static',
+    static_folder='static'
+)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
+
+data_directory = os.environ.get('DATA_DIR')
+if data_directory:
+    data_directory = os.path.abspath(data_directory)
+else:
+    data_directory = app.instance_path
+
+os.makedirs(data_directory, exist_ok=True)
+
+default_db_path = os.path.join(data_directory, 'database.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{default_db_path}')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['UPLOAD_FOLDER'] = os.path.join(data_directory, 'uploads')
+app.config['STATIC_PDF_FOLDER'] = os.path.join(app.static_folder, 'docs')
+app.config['STATIC_PDF_IMAGE_FOLDER'] = os.path.join(app.static_folder, 'docs_images')
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['QR_CACHE_FOLDER'] = os.path.join(data_directory, 'qr_cache')
+# Ommaviy QR eksport uchun fon jarayonlari soni
+app.config['QR_WORKERS'] = int(os.environ.get('QR_WORKERS', os.cpu_count() or 1))
+# PDF sahifalarini rasmga aylantiruvchi fon jarayonlar soni (0 - so'rov ichida sinxron)
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', 2))
+# PDF optimizatsiya (pikepdf) fon jarayonlari soni (0 - so'rov ichida sinxron)
+app.config['OPTIMIZE_WORKERS'] = int(os.environ.get('OPTIMIZE_WORKERS', 1))
+# Ommaviy import (CSV + ZIP) so'rovi uchun hajm chegarasi va optimizatsiya jarayonlari soni
+app.config['BULK_IMPORT_MAX_CONTENT_LENGTH'] = int(os.environ.get('BULK_IMPORT_MAX_CONTENT_LENGTH', 512 * 1024 * 1024))
+app.config['BULK_IMPORT_WORKERS'] = int(os.environ.get('BULK_IMPORT_WORKERS', os.cpu_count() or 1))
+# "running" holatida shuncha soniyadan ko'p qolib ketgan vazifa qayta navbatga qo'yiladi
+app.config['JOB_STALE_SECONDS'] = int(os.environ.get('JOB_STALE_SECONDS', 900))
+# PDF matnini ajratib qidiruv indeksiga yozuvchi fon jarayonlari soni (0 - so'rov ichida sinxron)
+app.config['TEXT_WORKERS'] = int(os.environ.get('TEXT_WORKERS', 1))
+# Bitta hujjatdan indeksga yoziladigan matn chegarasi (belgilarda)
+app.config['TEXT_INDEX_MAX_CHARS'] = int(os.environ.get('TEXT_INDEX_MAX_CHARS', 100000))
+# Username -> hujjat keshi (QR skanerlash yo'li uchun)
+app.config['DOCUMENT_CACHE_SIZE'] = int(os.environ.get('DOCUMENT_CACHE_SIZE', 10000))
+app.config['DOCUMENT_CACHE_TTL'] = int(os.environ.get('DOCUMENT_CACHE_TTL', 300))
+app.config['DOCUMENT_CACHE_NEGATIVE_TTL'] = int(os.environ.get('DOCUMENT_CACHE_NEGATIVE_TTL', 60))
+# Ommaviy sahifalarning siqilgan HTML keshi (user_page, pdf_viewer)
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 4096))
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 3600))
+# Prometheus metrikalari: workerlar o'z qiymatlarini shu papkaga yozadi, /metrics ularni jamlaydi
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(data_directory, 'metrics'))
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5.0))
+# Bo'sh bo'lmasa /metrics faqat "Authorization: Bearer <token>" bilan ochiladi
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# Workerlar o'rtasida umumiy kesh: memory (faqat joriy jarayon), sqlite (bitta server
+# ichidagi barcha workerlar, default) yoki redis (bir nechta server)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'sqlite').lower()
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL', os.path.join(data_directory, 'cache.db'))
+# Boshqa workerlardan kelgan invalidatsiya hodisalarini tekshirish oralig'i (soniya)
+app.config['CACHE_EVENT_POLL_INTERVAL'] = float(os.environ.get('CACHE_EVENT_POLL_INTERVAL', 1.0))
+# IP bo'yicha token bucket chegaralari: BURST ta so'rov birdaniga, keyin daqiqasiga PER_MINUTE ta (0 - o'chiq).
+# SCAN - ommaviy sahifalarda mavjud bo'lmagan username lar (skanerlar), LOGIN - admin kirish urinishlari
+app.config['SCAN_RATE_LIMIT_BURST'] = int(os.environ.get('SCAN_RATE_LIMIT_BURST', 30))
+app.config['SCAN_RATE_LIMIT_PER_MINUTE'] = float(os.environ.get('SCAN_RATE_LIMIT_PER_MINUTE', 30))
+app.config['LOGIN_RATE_LIMIT_BURST'] = int(os.environ.get('LOGIN_RATE_LIMIT_BURST', 5))
+app.config['LOGIN_RATE_LIMIT_PER_MINUTE'] = float(os.environ.get('LOGIN_RATE_LIMIT_PER_MINUTE', 5))
+# memory - har bir worker o'z hisobini yuritadi (default), shared - CACHE_BACKEND orqali umumiy
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+# PDF uzatish usuli: sendfile (wsgi.file_wrapper orqali, default), stream (Python generator),
+# x-accel (nginx X-Accel-Redirect) yoki x-sendfile (Apache/lighttpd X-Sendfile)
+app.config['PDF_SERVE_MODE'] = os.environ.get('PDF_SERVE_MODE', 'sendfile').lower()
+app.config['PDF_ACCEL_PREFIX'] = os.environ.get('PDF_ACCEL_PREFIX', '/_protected_docs')
+app.config['PDF_STREAM_CHUNK_SIZE'] = int(os.environ.get('PDF_STREAM_CHUNK_SIZE', 64 * 1024))
+# PDF saqlash joyi: local (STATIC_PDF_FOLDER, default) yoki s3 (S3 ga mos har qanday xizmat -
+# AWS, MinIO va h.k.; STATIC_PDF_FOLDER shu holatda lokal kesh bo'lib qoladi)
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local').lower()
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET', '')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', 'docs/')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL') or None
+app.config['S3_REGION'] = os.environ.get('S3_REGION') or None
+# Yetim fayllarni yig'ish (GC): oraliq (soniya, 0 - fon rejimi o'chiq) va yangi fayllar uchun kutish muddati
+app.config['GC_INTERVAL'] = int(os.environ.get('GC_INTERVAL', 3600))
+app.config['GC_GRACE_SECONDS'] = int(os.environ.get('GC_GRACE_SECONDS', 3600))
+# Hosila fayllar (sahifa rasmlari, DZI plitkalar, QR kesh) uchun disk chegarasi baytda (0 - cheklanmagan)
+app.config['DERIVED_CACHE_MAX_BYTES'] = int(os.environ.get('DERIVED_CACHE_MAX_BYTES', 0))
+# 1x sahifa rasmi uchun bayt byudjeti; boshqa o'lchamlar piksel maydoniga mos ravishda hisoblanadi
+app.config['PAGE_IMAGE_BYTE_BUDGET'] = int(os.environ.get('PAGE_IMAGE_BYTE_BUDGET', 150 * 1024))
+# Deep zoom (DZI) plitkalari: eng katta masshtab (72 dpi ga nisbatan), plitka o'lchami, ustma-ustlik
+app.config['DZI_MAX_SCALE'] = float(os.environ.get('DZI_MAX_SCALE', 4.0))
+app.config['DZI_TILE_SIZE'] = int(os.environ.get('DZI_TILE_SIZE', 256))
+app.config['DZI_OVERLAP'] = int(os.environ.get('DZI_OVERLAP', 1))
+app.config['DZI_TILE_FORMAT'] = os.environ.get('DZI_TILE_FORMAT', 'webp').lower()
+app.config['DZI_TILE_QUALITY'] = int(os.environ.get('DZI_TILE_QUALITY', 80))
+
+# DB engine profillari: auto (URL bo'yicha tanlanadi) yoki none (SQLAlchemy default sozlamalari)
+app.config['DB_ENGINE_PROFILE'] = os.environ.get('DB_ENGINE_PROFILE', 'auto').lower()
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+# MySQL wait_timeout dan kichik bo'lishi kerak, aks holda uzilgan ulanishlar pool da qoladi
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 280))
+
+
+def build_engine_profile(database_uri, config):
+    """
+    DB URL bo'yicha engine profilini tanlaydi.
+
+    Natija: (profil nomi, SQLALCHEMY_ENGINE_OPTIONS, har bir SQLite ulanishiga
+    qo'llanadigan PRAGMA lar ro'yxati).
+    """
+    if config['DB_ENGINE_PROFILE'] == 'none':
+        return 'none', {}, []
+
+    backend = make_url(database_uri).get_backend_name()
+    if backend == 'sqlite':
+        pragmas = [
+            ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+            ('synchronous', config['SQLITE_SYNCHRONOUS']),
+            ('busy_timeout', config['SQLITE_BUSY_TIMEOUT_MS']),
+            ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ]
+        options = {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+        return 'sqlite', options, pragmas
+
+    options = {
+        'pool_pre_ping': True,
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if backend in ('mysql', 'mariadb', 'postgresql'):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+        )
+    return backend, options, []
+
+
+db_profile_name, db_engine_options, sqlite_pragmas = build_engine_profile(
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config
+)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    **db_engine_options,
+    **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+}
+
+db = SQLAlchemy(app)
+
+if sqlite_pragmas:
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in sqlite_pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', _apply_sqlite_pragmas)
+
+# Profil `flask migrate` da (gunicorn on_starting hook i orqali ishga tushishda) chiqariladi;
+# import vaqtida har bir workerda chop etilmaydi
+DB_PROFILE_DESCRIPTION = (
+    f"DB engine profili: {db_profile_name} (options={db_engine_options}, pragmas={dict(sqlite_pragmas)})"
+)
+
+# Upload papkasini yaratish
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['STATIC_PDF_FOLDER'], exist_ok=True)
+os.makedirs(app.config['STATIC_PDF_IMAGE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['QR_CACHE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class HashingTemporaryFile:
+    """Yozilayotgan baytlarni bir vaqtning o'zida SHA-256 bilan xeshlaydigan vaqtinchalik fayl."""
+
+    def __init__(self, directory):
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix='.upload', dir=directory)
+        self.name = self._file.name
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """
+    Yuklanayotgan fayllarni xotirada yig'masdan to'g'ridan-to'g'ri UPLOAD_FOLDER
+    dagi vaqtinchalik faylga yozadi va yozish davomida xeshini hisoblaydi.
+    """
+
+    @property
+    def max_content_length(self):
+        # Ommaviy import arxivi oddiy bitta PDF dan ancha katta bo'ladi
+        if self.endpoint == 'bulk_import':
+            return app.config['BULK_IMPORT_MAX_CONTENT_LENGTH']
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = HashingTemporaryFile(app.config['UPLOAD_FOLDER'])
+        g.setdefault('upload_temp_files', []).append(upload.name)
+        return upload
+
+
+app.request_class = UploadRequest
+
+
+@app.teardown_request
+def remove_upload_temp_files(exc):
+    # Saqlash joyiga ko'chirilmagan vaqtinchalik fayllarni tozalash
+    for temp_path in g.pop('upload_temp_files', []):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+# Database modellari
+class Admin(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+
+# SQLite da CURRENT_TIMESTAMP soniya aniqligida matn sifatida saqlanadi; parametrlar ham
+# shu formatda berilmasa, keyset paginatsiyadagi (created_at, id) taqqoslash noto'g'ri ishlaydi
+DOCUMENT_DATETIME = db.DateTime().with_variant(
+    sqlite_dialect.DATETIME(
+        storage_format='%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d'
+    ),
+    'sqlite'
+)
+
+class Document(db.Model):
+    __table_args__ = (
+        # Dashboard keyset paginatsiyasi uchun (created_at, id) tartibi
+        db.Index('ix_document_created_at_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), unique=True, nullable=False, index=True)
+    # PDF yuklanmasdan ham username yaratish mumkin; indeks - fayl havolalarini sanash (GC) uchun
+    filename = db.Column(db.String(255), nullable=True, index=True)
+    original_filename = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(DOCUMENT_DATETIME, default=db.func.now())
+    # Asl yuklangan faylning SHA-256 xeshi; bir xil fayl bir necha username uchun bitta nusxada saqlanadi
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    # PDF optimizatsiya holati: pending / optimizing / ready / failed
+    status = db.Column(db.String(16), nullable=True, default='ready')
+    
+    def has_pdf(self):
+        """PDF yuklanganligini tekshirish"""
+        return self.filename is not None and self.filename != ''
+
+class ProcessingJob(db.Model):
+    """Fon vazifalari jadvali - worker qayta ishga tushsa ham vazifalar yo'qolmaydi"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    # pending / running / done / failed
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
+class DocumentText(db.Model):
+    """PDF dan ajratilgan matn (qidiruv uchun); bir xil fayl bir necha username da bo'lsa - bitta yozuv"""
+    __tablename__ = 'document_text'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)
+    body = db.Column(db.Text, nullable=False)
+    page_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
+class SchemaVersion(db.Model):
+    """Qo'llangan sxema migratsiyalari - har bir versiya bir marta yoziladi"""
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=db.func.now())
+
+# Prometheus metrikalari: nom -> (turi, tavsif)
+METRIC_DEFINITIONS = {
+    'shahodatnoma_request_duration_seconds': ('histogram', "HTTP so'rovlar davomiyligi (endpoint bo'yicha)"),
+    'shahodatnoma_requests_total': ('counter', "HTTP so'rovlar soni (endpoint va status bo'yicha)"),
+    'shahodatnoma_stage_duration_seconds': ('histogram', "So'rov/vazifa bosqichlari davomiyligi (db, template, render, optimize, extract, search, qr)"),
+    'shahodatnoma_cache_requests_total': ('counter', "Kesh murojaatlari (hit/miss)"),
+    'shahodatnoma_pdf_bytes_served_total': ('counter', "serve_pdf uzatgan baytlar (Content-Length bo'yicha)"),
+    'shahodatnoma_pdf_range_requests_total': ('counter', "Range so'rovlari (single, multi, unsatisfiable, ignored)"),
+    'shahodatnoma_render_queue_depth': ('gauge', "Render navbatidagi hujjatlar soni"),
+    'shahodatnoma_processing_jobs': ('gauge', "processing_job jadvalidagi vazifalar (status bo'yicha)"),
+    'shahodatnoma_gc_removed_files_total': ('counter', "GC o'chirgan fayllar (orphan_pdf, orphan_images, temp, evicted)"),
+    'shahodatnoma_gc_reclaimed_bytes_total': ('counter', "GC bo'shatgan disk hajmi (LRU tozalash)"),
+    'shahodatnoma_rejected_requests_total': ('counter', "DB ga yetmasdan rad etilgan so'rovlar (unknown_username, scan_limit, login_limit)"),
+}
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """
+    Jarayon ichidagi thread-safe metrikalar (counter, gauge, histogram).
+
+    Har bir worker o'z qiymatlarini METRICS_DIR/<pid>.json ga yozib turadi,
+    `/metrics` esa barcha workerlar fayllarini jamlab Prometheus formatida beradi.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                # Har bir bucket dagi kumulyativ son, keyin yig'indi va umumiy son
+                histogram = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                [name, [list(label) for label in labels], list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+
+
+metrics = MetricsRegistry(METRIC_BUCKETS)
+_metrics_next_flush = 0
+
+
+def flush_metrics(force=False):
+    """Joriy worker metrikalarini diskka yozish (METRICS_FLUSH_INTERVAL da bir martadan ko'p emas)"""
+    global _metrics_next_flush
+    now = time.monotonic()
+    if not force and now < _metrics_next_flush:
+        return
+    _metrics_next_flush = now + app.config['METRICS_FLUSH_INTERVAL']
+    metrics.set('shahodatnoma_render_queue_depth', len(_render_jobs))
+
+    payload = {'written_at': time.time(), 'samples': metrics.snapshot()}
+    path = os.path.join(app.config['METRICS_DIR'], f'{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as metrics_file:
+            json.dump(payload, metrics_file)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def collect_metrics():
+    """Barcha workerlar yozgan metrikalarni jamlash: (nom, labellar) -> qiymat"""
+    merged = {}
+    # Uzoq vaqt yangilanmagan (to'xtagan) worker gauge lari hisobga olinmaydi, counterlar esa qoladi
+    gauge_deadline = time.time() - max(60, 3 * app.config['METRICS_FLUSH_INTERVAL'])
+    for entry in os.scandir(app.config['METRICS_DIR']):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path, encoding='utf-8') as metrics_file:
+                payload = json.load(metrics_file)
+        except (OSError, ValueError):
+            continue
+        # exited-<pid>-*.json - to'xtagan worker fayli (gunicorn child_exit), faqat counterlari qoladi
+        fresh = not entry.name.startswith('exited-') and payload.get('written_at', 0) >= gauge_deadline
+        for name, labels, value in payload.get('samples', []):
+            metric_type = METRIC_DEFINITIONS.get(name, ('counter',))[0]
+            if metric_type == 'gauge' and not fresh:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            if isinstance(value, list):
+                existing = merged.get(key)
+                merged[key] = [a + b for a, b in zip(existing, value)] if existing else value
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _format_metric_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_metrics(merged):
+    """Jamlangan metrikalarni Prometheus text formatiga o'tkazish"""
+    lines = []
+    for name, (metric_type, description) in METRIC_DEFINITIONS.items():
+        samples = sorted((labels, value) for (sample_name, labels), value in merged.items() if sample_name == name)
+        if not samples:
+            continue
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in samples:
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_format_metric_labels(labels)} {value}')
+                continue
+            for bound, count in zip(METRIC_BUCKETS, value):
+                lines.append(f'{name}_bucket{_format_metric_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{_format_metric_labels(labels, [("le", "+Inf")])} {value[-1]}')
+            lines.append(f'{name}_sum{_format_metric_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{_format_metric_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def timed_stage(stage):
+    """Bosqich davomiyligini histogramga va so'rovning Server-Timing sarlavhasiga yozish"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_stage(stage, elapsed):
+    metrics.observe('shahodatnoma_stage_duration_seconds', elapsed, stage=stage)
+    if has_request_context():
+        timings = g.setdefault('server_timing', {})
+        timings[stage] = timings.get(stage, 0) + elapsed
+
+
+def record_cache_lookup(cache_name, hit):
+    metrics.inc('shahodatnoma_cache_requests_total', cache=cache_name, result='hit' if hit else 'miss')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('shahodatnoma_request_duration_seconds', elapsed, endpoint=endpoint, method=request.method)
+    metrics.inc('shahodatnoma_requests_total', endpoint=endpoint, status=response.status_code)
+
+    timings = [f'{stage};dur={duration * 1000:.1f}' for stage, duration in g.get('server_timing', {}).items()]
+    timings.append(f'total;dur={elapsed * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    flush_metrics()
+    return response
+
+
+class LRUCache:
+    """Hajmi chegaralangan, yozuvlari TTL bo'yicha eskiradigan thread-safe LRU kesh."""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING or entry[1] <= now:
+                if entry is not self._MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class MemoryCacheBackend:
+    """Faqat joriy jarayon ichidagi kesh backendi (workerlar o'rtasida bo'linmaydi)."""
+
+    shared = False
+
+    def __init__(self):
+        self._store = LRUCache(maxsize=100000, ttl=3600)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._store.get(key)
+
+    def set(self, key, value, ttl):
+        self._store.set(key, value, ttl=ttl)
+
+    def add(self, key, value, ttl):
+        with self._lock:
+            if self._store.get(key) is not None:
+                return False
+            self._store.set(key, value, ttl=ttl)
+            return True
+
+    def delete(self, key):
+        self._store.delete(key)
+
+    def publish_invalidation(self, key):
+        pass
+
+    def compact(self):
+        pass
+
+    def latest_event_id(self):
+        return 0
+
+    def poll_invalidations(self, cursor):
+        return [], cursor
+
+
+class SQLiteCacheBackend:
+    """
+    Bitta server ichidagi barcha gunicorn workerlari uchun umumiy kesh (SQLite WAL fayl).
+
+    Invalidatsiya hodisalari `cache_event` jadvaliga yoziladi va har bir worker
+    ularni o'zining lokal keshidan o'chirish uchun o'qib boradi.
+    """
+
+    shared = True
+    EVENT_RETENTION = 3600
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_purge = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entry ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_event ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _maybe_purge(self, connection, now, force=False):
+        if now < self._next_purge and not force:
+            return
+        self._next_purge = now + self.PURGE_INTERVAL
+        connection.execute('DELETE FROM cache_entry WHERE expires_at <= ?', (now,))
+        connection.execute('DELETE FROM cache_event WHERE created_at <= ?', (now - self.EVENT_RETENTION,))
+
+    def compact(self):
+        """Eskirgan yozuvlarni o'chirish va WAL faylini qisqartirish (GC o'tishida)"""
+        connection = self._connection()
+        self._maybe_purge(connection, time.time(), force=True)
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, value, now + ttl)
+        )
+        self._maybe_purge(connection, now)
+
+    def add(self, key, value, ttl):
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM cache_entry WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, now + ttl)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def publish_invalidation(self, key):
+        self._connection().execute(
+            'INSERT INTO cache_event (key, created_at) VALUES (?, ?)', (key, time.time())
+        )
+
+    def latest_event_id(self):
+        return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM cache_event').fetchone()[0]
+
+    def poll_invalidations(self, cursor):
+        rows = self._connection().execute(
+            'SELECT id, key FROM cache_event WHERE id > ? ORDER BY id', (cursor,)
+        ).fetchall()
+        if not rows:
+            return [], cursor
+        return [key for _, key in rows], rows[-1][0]
+
+
+class RedisCacheBackend:
+    """
+    Redis protokoli orqali bir nechta serverlar uchun umumiy kesh.
+
+    Invalidatsiya hodisalari Redis stream ga yoziladi. Testlarda `client`
+    o'rniga Redis API ga mos lokal obyekt (masalan fakeredis) berish mumkin.
+    """
+
+    shared = True
+    EVENT_STREAM = 'shahodatnoma:cache-events'
+    EVENT_STREAM_MAXLEN = 10000
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis uchun 'redis' paketi o'rnatilmagan")
+        return cls(redis.Redis.from_url(url))
+
+    @staticmethod
+    def _decode(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def get(self, key):
+        return self._decode(self.client.get(key))
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, px=int(ttl * 1000))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, px=int(ttl * 1000), nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def compact(self):
+        # Muddati o'tgan kalitlarni Redis o'zi o'chiradi, stream esa maxlen bilan cheklangan
+        pass
+
+    def publish_invalidation(self, key):
+        self.client.xadd(self.EVENT_STREAM, {'key': key}, maxlen=self.EVENT_STREAM_MAXLEN, approximate=True)
+
+    def latest_event_id(self):
+        entries = self.client.xrevrange(self.EVENT_STREAM, count=1)
+        return self._decode(entries[0][0]) if entries else '0-0'
+
+    def poll_invalidations(self, cursor):
+        response = self.client.xread({self.EVENT_STREAM: cursor}, count=1000)
+        if not response:
+            return [], cursor
+        entries = response[0][1]
+        keys = [self._decode(fields.get(b'key', fields.get('key'))) for _, fields in entries]
+        return keys, self._decode(entries[-1][0])
+
+
+def create_cache_backend(config):
+    """Konfiguratsiyadagi CACHE_BACKEND bo'yicha kesh backendini yaratish"""
+    backend_name = config['CACHE_BACKEND']
+    if backend_name == 'redis':
+        return RedisCacheBackend.from_url(config['CACHE_URL'])
+    if backend_name == 'sqlite':
+        return SQLiteCacheBackend(config['CACHE_URL'])
+    return MemoryCacheBackend()
+
+
+class SharedCache:
+    """
+    Ikki bosqichli kesh: jarayon ichidagi LRU + workerlar o'rtasidagi umumiy backend.
+
+    Qiymatlar backendda JSON ko'rinishida saqlanadi. `invalidate` boshqa
+    workerlarga hodisa yuboradi; ular lokal nusxani keyingi tekshiruvda o'chiradi.
+    DB dan o'qishdan oldin `generation` olinadi: o'qish davomida `invalidate`
+    bo'lsa, `set` eskirgan qiymatni keshga qayta yozmaydi.
+    """
+
+    def __init__(self, backend, namespace, maxsize, ttl, poll_interval):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(maxsize, ttl)
+        self.poll_interval = poll_interval
+        self.backend_hits = 0
+        self.backend_misses = 0
+        self._cursor = None
+        self._next_poll = 0
+        self._lock = threading.Lock()
+        self._invalidations = 0
+
+    def _backend_key(self, key):
+        return f'shahodatnoma:{self.namespace}:{key}'
+
+    def _generation_key(self, key):
+        return f'shahodatnoma:{self.namespace}-generation:{key}'
+
+    def _sync_invalidations(self):
+        if not self.backend.shared:
+            return
+        now = time.monotonic()
+        if now < self._next_poll or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_poll = now + self.poll_interval
+            if self._cursor is None:
+                self._cursor = self.backend.latest_event_id()
+                return
+            keys, self._cursor = self.backend.poll_invalidations(self._cursor)
+        except Exception:
+            return
+        finally:
+            self._lock.release()
+
+        prefix = self._backend_key('')
+        for backend_key in keys:
+            if backend_key.startswith(prefix):
+                self.local.delete(backend_key[len(prefix):])
+                self._invalidations += 1
+
+    def get(self, key):
+        self._sync_invalidations()
+        value = self.local.get(key)
+        if value is not None or not self.backend.shared:
+            return value
+
+        try:
+            raw_value = self.backend.get(self._backend_key(key))
+        except Exception:
+            raw_value = None
+        if raw_value is None:
+            self.backend_misses += 1
+            return None
+        self.backend_hits += 1
+        value = json.loads(raw_value)
+        self.local.set(key, value)
+        return value
+
+    def generation(self, key):
+        """Qiymatni manbadan o'qishdan oldingi avlod belgisi (keyin `set` ga beriladi)"""
+        remote = None
+        if self.backend.shared:
+            try:
+                remote = self.backend.get(self._generation_key(key))
+            except Exception:
+                remote = None
+        return self._invalidations, remote
+
+    def set(self, key, value, ttl=None, generation=None):
+        if generation is not None and generation != self.generation(key):
+            # O'qish davomida qiymat o'zgargan - eskirgan nusxani yozmaymiz
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(key, value, ttl=ttl)
+        if self.backend.shared:
+            try:
+                self.backend.set(self._backend_key(key), json.dumps(value), ttl)
+            except Exception:
+                pass
+
+    def invalidate(self, key):
+        self._invalidations += 1
+        self.local.delete(key)
+        if self.backend.shared:
+            backend_key = self._backend_key(key)
+            try:
+                self.backend.set(self._generation_key(key), f'{os.getpid()}:{time.time_ns()}', self.ttl)
+                self.backend.delete(backend_key)
+                self.backend.publish_invalidation(backend_key)
+            except Exception:
+                # Backend ishlamasa ham yozuv o'zgarishi (upload/delete) muvaffaqiyatli tugashi kerak;
+                # boshqa workerlardagi nusxa TTL dan keyin eskiradi
+                app.logger.warning("Kesh yozuvini backendda o'chirib bo'lmadi: %s", key, exc_info=True)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['backend'] = type(self.backend).__name__
+        stats['backend_hits'] = self.backend_hits
+        stats['backend_misses'] = self.backend_misses
+        return stats
+
+
+DocumentRef = namedtuple('DocumentRef', ['id', 'username', 'filename', 'has_pdf'])
+
+cache_backend = create_cache_backend(app.config)
+document_cache = SharedCache(
+    cache_backend,
+    'document',
+    app.config['DOCUMENT_CACHE_SIZE'],
+    app.config['DOCUMENT_CACHE_TTL'],
+    app.config['CACHE_EVENT_POLL_INTERVAL']
+)
+
+
+def lookup_document(username):
+    """Username bo'yicha hujjatni keshdan (yoki DB dan) topish; topilmasa None"""
+    cached = document_cache.get(username)
+    record_cache_lookup('document', cached is not None)
+    if cached is not None:
+        # Bo'sh dict - mavjud bo'lmagan username (botlar tasodifiy yo'llarni skanerlaydi)
+        return DocumentRef(**cached) if cached else None
+
+    generation = document_cache.generation(username)
+    with timed_stage('db'):
+        document = Document.query.filter_by(username=username).first()
+    if document is None:
+        document_cache.set(
+            username, {}, ttl=app.config['DOCUMENT_CACHE_NEGATIVE_TTL'], generation=generation
+        )
+        return None
+
+    ref = DocumentRef(document.id, document.username, document.filename, document.has_pdf())
+    document_cache.set(username, ref._asdict(), generation=generation)
+    return ref
+
+
+def invalidate_document(username):
+    """Username ga tegishli kesh yozuvini barcha workerlarda o'chirish (hujjat o'zgarganda chaqiriladi)"""
+    document_cache.invalidate(username)
+    purge_cached_pages(username)
+
+
+# Tayyor HTML sahifalar: kalit - sahifa:username:variant, qiymat - CachedPage.
+# Versiya (PDF fayl nomi) kalit ichida emas, qiymatda saqlanadi: boshqa workerlarda
+# document_cache yangilanishi bilan eski versiya o'z-o'zidan mos kelmay qoladi.
+CachedPage = namedtuple('CachedPage', ['version', 'etag', 'bodies'])
+PAGE_CACHE_VARIANTS = ('user:android', 'user:desktop', 'viewer:all')
+
+page_cache = LRUCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+
+
+def purge_cached_pages(username):
+    """Username ning barcha sahifa variantlarini joriy jarayon keshidan o'chirish"""
+    for variant in PAGE_CACHE_VARIANTS:
+        page, _, client = variant.partition(':')
+        page_cache.delete(f'{page}:{username}:{client}')
+
+
+class TokenBucketLimiter:
+    """
+    Kalit (klient IP) bo'yicha token bucket: `burst` tagacha token, daqiqasiga `per_minute` ta tiklanadi.
+
+    Holat jarayon ichidagi LRU da yoki umumiy kesh backendida ("tokenlar:vaqt"
+    qatori) saqlanadi. Backendda o'qish va yozish atomik emas - bir vaqtdagi
+    so'rovlarda bir-ikkitasi ortiqcha o'tishi mumkin, chegaralash uchun bu yetarli.
+    """
+
+    def __init__(self, name, burst, per_minute, backend=None, maxsize=100000):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.enabled = burst > 0 and per_minute > 0
+        self.backend = backend if backend is not None and backend.shared else None
+        # To'liq tiklangan bucket saqlanmasa ham bo'ladi
+        self.ttl = math.ceil(burst / self.rate) + 1 if self.enabled else 1
+        self.local = LRUCache(maxsize, self.ttl)
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        return f'shahodatnoma:ratelimit:{self.name}:{key}'
+
+    def _load(self, key, now):
+        if self.backend is not None:
+            try:
+                raw_value = self.backend.get(self._key(key))
+            except Exception:
+                raw_value = None
+        else:
+            raw_value = self.local.get(key)
+        if raw_value is None:
+            return float(self.burst)
+        tokens, updated_at = map(float, raw_value.split(':'))
+        return min(float(self.burst), tokens + max(now - updated_at, 0) * self.rate)
+
+    def _store(self, key, tokens, now):
+        raw_value = f'{tokens:.4f}:{now:.3f}'
+        if self.backend is not None:
+            try:
+                self.backend.set(self._key(key), raw_value, self.ttl)
+            except Exception:
+                pass
+        else:
+            self.local.set(key, raw_value)
+
+    def blocked(self, key):
+        """Bucket bo'sh bo'lsa True (token sarflamaydi)"""
+        if not self.enabled:
+            return False
+        return self._load(key, time.time()) < 1
+
+    def consume(self, key, cost=1):
+        """Token sarflash; yetmasa False"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            now = time.time()
+            tokens = self._load(key, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._store(key, tokens, now)
+        return allowed
+
+    def retry_after(self, key):
+        """Keyingi token tiklanguncha soniyalar (Retry-After sarlavhasi uchun)"""
+        if not self.enabled:
+            return 0
+        missing = 1 - self._load(key, time.time())
+        return max(math.ceil(missing / self.rate), 1)
+
+
+def _create_limiter(name):
+    backend = cache_backend if app.config['RATE_LIMIT_BACKEND'] == 'shared' else None
+    return TokenBucketLimiter(
+        name,
+        app.config[f'{name.upper()}_RATE_LIMIT_BURST'],
+        app.config[f'{name.upper()}_RATE_LIMIT_PER_MINUTE'],
+        backend=backend,
+    )
+
+
+scan_limiter = _create_limiter('scan')
+login_limiter = _create_limiter('login')
+
+
+def client_address():
+    # ProxyFix X-Forwarded-For dan haqiqiy mijoz manzilini remote_addr ga yozadi
+    return request.remote_addr or 'unknown'
+
+
+def rate_limited_response(limiter, key):
+    response = make_response("So'rovlar juda ko'p, birozdan keyin urinib ko'ring.\n", 429)
+    response.mimetype = 'text/plain'
+    response.headers['Retry-After'] = str(limiter.retry_after(key))
+    return response
+
+
+class UsernameFilter:
+    """
+    Mavjud username lar to'plami: yo'q username lar DB ga murojaatsiz rad etiladi.
+
+    Har bir worker to'plamni o'zida saqlaydi. Username qo'shilsa yoki
+    o'chirilsa `invalidate` umumiy backenddagi avlod belgisini yangilaydi;
+    boshqa workerlar uni CACHE_EVENT_POLL_INTERVAL da bir tekshirib, to'plamni
+    qayta quradi. Backend umumiy bo'lmasa (memory) yoki belgi yetib kelmasa
+    ham, to'plam `max_age` soniyadan eskirmaydi - salbiy document_cache TTL
+    bilan bir xil kechikish.
+    """
+
+    GENERATION_KEY = 'shahodatnoma:usernames-generation'
+
+    def __init__(self, backend, poll_interval, max_age):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.rejected = 0
+        self._usernames = None
+        self._generation = None
+        self._next_poll = 0
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _remote_generation(self):
+        if not self.backend.shared:
+            return None
+        try:
+            return self.backend.get(self.GENERATION_KEY)
+        except Exception:
+            return self._generation
+
+    def _sync(self):
+        now = time.monotonic()
+        if now < self._next_poll and self._usernames is not None:
+            return
+        self._next_poll = now + self.poll_interval
+        generation = self._remote_generation()
+        if self._usernames is not None and generation == self._generation and now < self._expires_at:
+            return
+        with timed_stage('db'):
+            usernames = frozenset(
+                username.lower() for (username,) in db.session.query(Document.username)
+            )
+        self._usernames, self._generation = usernames, generation
+        self._expires_at = now + self.max_age
+
+    def might_exist(self, username):
+        """Username bazada bo'lishi mumkinmi (False - aniq yo'q)"""
+        with self._lock:
+            self._sync()
+            found = username.lower() in self._usernames
+        if not found:
+            self.rejected += 1
+        return found
+
+    def invalidate(self):
+        """Username qo'shilgan yoki o'chirilgandan keyin (commit dan so'ng) chaqiriladi"""
+        with self._lock:
+            self._usernames = None
+        if self.backend.shared:
+            try:
+                self.backend.set(self.GENERATION_KEY, f'{os.getpid()}:{time.time_ns()}', 30 * 24 * 3600)
+            except Exception:
+                pass  # Boshqa workerlar to'plamni max_age dan keyin baribir qayta quradi
+
+    def stats(self):
+        return {
+            'size': len(self._usernames) if self._usernames is not None else None,
+            'rejected': self.rejected,
+        }
+
+
+username_filter = UsernameFilter(
+    cache_backend,
+    app.config['CACHE_EVENT_POLL_INTERVAL'],
+    app.config['DOCUMENT_CACHE_NEGATIVE_TTL']
+)
+
+
+def find_public_document(username):
+    """
+    Ommaviy sahifalar uchun hujjatni topish; skanerlar uchun arzon rad etish.
+
+    IP dan kelgan noma'lum username lar soni SCAN chegarasidan oshsa, 429
+    qaytariladi. Mavjud bo'lmagan username DB ga yetmasdan 404 bo'ladi.
+    """
+    address = client_address()
+    if scan_limiter.blocked(address):
+        metrics.inc('shahodatnoma_rejected_requests_total', reason='scan_limit')
+        abort(rate_limited_response(scan_limiter, address))
+
+    if username in ('favicon.ico', 'robots.txt', 'sitemap.xml') or not username_filter.might_exist(username):
+        metrics.inc('shahodatnoma_rejected_requests_total', reason='unknown_username')
+        document = None
+    else:
+        document = lookup_document(username)
+    if document is None:
+        scan_limiter.consume(address)
+        abort(404)
+    return document
+
+
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'admin_logged_in' not in session:
+            return redirect(url_for('admin_login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _migrate_filename_nullable(connection):
+    """filename va original_filename ustunlarini nullable qilish (jadvalni qayta qurish)"""
+    inspector = inspect(connection)
+    if 'document' not in inspector.get_table_names():
+        return
+    columns = {col['name']: col for col in inspector.get_columns('document')}
+    filename_col = columns.get('filename')
+    original_col = columns.get('original_filename')
+    if not ((filename_col and not filename_col.get('nullable', True)) or (
+        original_col and not original_col.get('nullable', True)
+    )):
+        return
+    connection.execute(text("ALTER TABLE document RENAME TO document_old"))
+    connection.execute(text(
+        """
+        CREATE TABLE document (
+            id INTEGER NOT NULL PRIMARY KEY,
+            username VARCHAR(100) NOT NULL UNIQUE,
+            filename VARCHAR(255),
+            original_filename VARCHAR(255),
+            created_at DATETIME DEFAULT (CURRENT_TIMESTAMP)
+        )
+        """
+    ))
+    connection.execute(text(
+        """
+        INSERT INTO document (id, username, filename, original_filename, created_at)
+        SELECT id, username, filename, original_filename, created_at FROM document_old
+        """
+    ))
+    connection.execute(text("DROP TABLE document_old"))
+
+
+def _migrate_added_columns(connection):
+    """Keyinroq qo'shilgan ustunlar: content_hash (indeks bilan) va status"""
+    added_columns = {
+        'content_hash': [
+            "ALTER TABLE document ADD COLUMN content_hash VARCHAR(64)",
+            "CREATE INDEX ix_document_content_hash ON document (content_hash)",
+        ],
+        'status': [
+            "ALTER TABLE document ADD COLUMN status VARCHAR(16) DEFAULT 'ready'",
+        ],
+    }
+    inspector = inspect(connection)
+    if 'document' not in inspector.get_table_names():
+        return
+    columns = {col['name'] for col in inspector.get_columns('document')}
+    for column_name, statements in added_columns.items():
+        if column_name in columns:
+            continue
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def _migrate_created_at_index(connection):
+    """Dashboard keyset paginatsiyasi uchun (created_at, id) indeksi"""
+    inspector = inspect(connection)
+    if 'document' not in inspector.get_table_names():
+        return
+    indexes = {index['name'] for index in inspector.get_indexes('document')}
+    if 'ix_document_created_at_id' not in indexes:
+        connection.execute(text(
+            "CREATE INDEX ix_document_created_at_id ON document (created_at, id)"
+        ))
+
+
+def _migrate_filename_index(connection):
+    """Fayl havolalarini sanash (release_pdf_file, GC) uchun filename indeksi"""
+    inspector = inspect(connection)
+    if 'document' not in inspector.get_table_names():
+        return
+    indexes = {index['name'] for index in inspector.get_indexes('document')}
+    if 'ix_document_filename' not in indexes:
+        connection.execute(text("CREATE INDEX ix_document_filename ON document (filename)"))
+
+
+# SQLite FTS5 indeksi document_text ning tashqi-kontent jadvali; triggerlar uni har bir
+# INSERT/UPDATE/DELETE da yangilab boradi (qayta qurish shart emas)
+DOCUMENT_TEXT_FTS_STATEMENTS = (
+    "CREATE VIRTUAL TABLE document_text_fts USING fts5("
+    "body, content='document_text', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER document_text_ai AFTER INSERT ON document_text BEGIN "
+    "INSERT INTO document_text_fts(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER document_text_ad AFTER DELETE ON document_text BEGIN "
+    "INSERT INTO document_text_fts(document_text_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER document_text_au AFTER UPDATE ON document_text BEGIN "
+    "INSERT INTO document_text_fts(document_text_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+    "INSERT INTO document_text_fts(rowid, body) VALUES (new.id, new.body); END",
+    "INSERT INTO document_text_fts(document_text_fts) VALUES ('rebuild')",
+)
+
+
+def _migrate_document_text_fts(connection):
+    """Matn jadvali va (SQLite da FTS5 bo'lsa) to'liq matnli qidiruv indeksi"""
+    DocumentText.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name != 'sqlite':
+        return  # Boshqa bazalarda LIKE bo'yicha qidiriladi
+    if 'document_text_fts' in inspect(connection).get_table_names():
+        return
+    try:
+        connection.execute(text("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(body)"))
+        connection.execute(text("DROP TABLE temp._fts5_probe"))
+    except OperationalError:
+        return  # SQLite FTS5 siz yig'ilgan
+    for statement in DOCUMENT_TEXT_FTS_STATEMENTS:
+        connection.execute(text(statement))
+
+
+# Sxema migratsiyalari: (versiya, nom, funksiya). Har biri idempotent - qayta ishga tushsa sxemani
+# buzmaydi; bir vaqtdagi ishga tushirishlar schema_migration_lock bilan navbatga qo'yiladi.
+# Yangilari faqat oxiriga qo'shiladi.
+SCHEMA_MIGRATIONS = [
+    (1, 'document_filename_nullable', _migrate_filename_nullable),
+    (2, 'document_content_hash_status', _migrate_added_columns),
+    (3, 'document_created_at_index', _migrate_created_at_index),
+    (4, 'document_filename_index', _migrate_filename_index),
+    (5, 'document_text_fts', _migrate_document_text_fts),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def get_schema_version():
+    """Bazada qo'llangan eng so'nggi migratsiya versiyasi (jadval bo'lmasa 0)"""
+    with app.app_context():
+        if 'schema_version' not in inspect(db.engine).get_table_names():
+            return 0
+        with db.engine.connect() as connection:
+            version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+        return version or 0
+
+
+MIGRATION_LOCK_NAME = 'shahodatnoma_schema_migrate'
+MIGRATION_LOCK_TIMEOUT = 300
+
+
+@contextmanager
+def schema_migration_lock():
+    """
+    Migratsiyalarni jarayonlar va serverlar o'rtasida ketma-ket bajarish uchun qulf.
+
+    SQLite da DDL autocommit rejimida, MySQL da tranzaksiyasiz bajariladi - bir vaqtda
+    ishlagan ikkinchi jarayon yarim qo'llangan migratsiyaga urilib OperationalError oladi.
+    SQLite - baza fayli yonidagi flock, MySQL - GET_LOCK, PostgreSQL - advisory lock.
+    """
+    engine = db.engine
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        database = engine.url.database
+        if fcntl is None or not database or database == ':memory:':
+            yield
+            return
+        with open(f'{database}.migrate.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    if dialect not in ('mysql', 'postgresql'):
+        yield
+        return
+
+    # Qulf ulanish (sessiya) ga bog'langan - migratsiyalar tugaguncha shu ulanish ochiq turadi
+    with engine.connect() as connection:
+        if dialect == 'mysql':
+            acquired = connection.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"),
+                {'name': MIGRATION_LOCK_NAME, 'timeout': MIGRATION_LOCK_TIMEOUT}
+            ).scalar()
+            if acquired != 1:
+                raise RuntimeError("Migratsiya qulfini olib bo'lmadi (boshqa jarayon hali migratsiya qilmoqda)")
+            release = text("SELECT RELEASE_LOCK(:name)")
+        else:
+            connection.execute(text("SELECT pg_advisory_lock(hashtext(:name))"), {'name': MIGRATION_LOCK_NAME})
+            release = text("SELECT pg_advisory_unlock(hashtext(:name))")
+        connection.commit()
+        try:
+            yield
+        finally:
+            connection.execute(release, {'name': MIGRATION_LOCK_NAME})
+            connection.commit()
+
+
+def migrate_schema():
+    """Qo'llanmagan migratsiyalarni bajarish va schema_version ga yozish"""
+    applied = []
+    with app.app_context(), schema_migration_lock():
+        with db.engine.begin() as connection:
+            SchemaVersion.__table__.create(connection, checkfirst=True)
+        # Qulf olingandan keyin o'qiladi: oldingi jarayon qo'llaganlari qayta bajarilmaydi
+        with db.engine.connect() as connection:
+            done = set(connection.execute(text("SELECT version FROM schema_version")).scalars())
+        for version, name, migration in SCHEMA_MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                with db.engine.begin() as connection:
+                    migration(connection)
+                    connection.execute(insert(SchemaVersion.__table__).values(
+                        version=version, name=name,
+                    ))
+            except IntegrityError:
+                # Qulfsiz dialektlarda boshqa jarayon shu migratsiyani allaqachon qo'llagan bo'lishi mumkin
+                continue
+            applied.append(name)
+            print(f"Migratsiya qo'llandi: {version} {name}")
+
+        db.create_all()
+    return applied
+
+
+def move_legacy_uploads():
+    """Eski uploads papkasidagi PDF larni static papkaga ko'chirish (idempotent)"""
+    moved = 0
+    with app.app_context():
+        for document in Document.query.filter(Document.filename != None).all():  # noqa: E711
+            old_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+            if os.path.exists(old_path) and not pdf_storage.exists(document.filename):
+                pdf_storage.save(old_path, document.filename)
+                moved += 1
+    return moved
+
+
+def sync_admin_account():
+    """Admin yaratish/yangilash (.env dan o'qiladi). Parol o'zgarmagan bo'lsa bazaga yozilmaydi."""
+    admin_username = os.environ.get('ADMIN_USERNAME', 'admin')
+    admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
+
+    with app.app_context():
+        existing_admin = Admin.query.filter_by(username=admin_username).first()
+
+        if existing_admin:
+            if check_password_hash(existing_admin.password_hash, admin_password):
+                return
+            # Admin mavjud - parolni yangilash (.env dagi parol bilan)
+            existing_admin.password_hash = generate_password_hash(admin_password)
+            db.session.commit()
+            print(f"Admin parol yangilandi: username='{admin_username}'")
+        else:
+            # Yangi admin yaratish
+            admin = Admin(
+                username=admin_username,
+                password_hash=generate_password_hash(admin_password)
+            )
+            db.session.add(admin)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Parallel ishga tushgan boshqa jarayon allaqachon yaratgan
+                db.session.rollback()
+                return
+            print(f"Yangi admin yaratildi: username='{admin_username}'")
+
+
+def init_db():
+    """Database sxemasini yangilash, eski fayllarni ko'chirish va admin yaratish.
+
+    Import vaqtida emas, deploy paytida bir marta ishga tushiriladi:
+    `flask --app app migrate` yoki gunicorn.conf.py dagi on_starting hook orqali.
+    """
+    migrate_schema()
+    move_legacy_uploads()
+    sync_admin_account()
+
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+QR_DEFAULT_SIZE = 10
+QR_SIZE_RANGE = (2, 40)
+# Shundan kam QR kod process pool ga yuborilmaydi - jarayonlararo uzatish qimmatroq
+QR_POOL_THRESHOLD = 32
+
+
+def generate_qr_code(url, size=QR_DEFAULT_SIZE, fmt='png'):
+    """QR kod yaratish (PNG yoki SVG baytlari)"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=size,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+
+    buffered = BytesIO()
+    if fmt == 'svg':
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffered)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def _qr_cache_key(url, size, fmt):
+    return hashlib.sha1(f'{url}|{size}|{fmt}'.encode('utf-8')).hexdigest()
+
+
+def _qr_cache_path(cache_key, fmt):
+    return os.path.join(app.config['QR_CACHE_FOLDER'], f'{cache_key}.{fmt}')
+
+
+def _store_qr_code(path, data):
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as qr_file:
+        qr_file.write(data)
+    os.replace(temp_path, path)
+
+
+def get_qr_code(url, size=QR_DEFAULT_SIZE, fmt='png'):
+    """
+    (URL, o'lcham, format) bo'yicha diskda keshlangan QR kod faylini qaytaradi.
+
+    Natija: (fayl yo'li, kesh kaliti); kalit ETag sifatida ishlatiladi.
+    """
+    cache_key = _qr_cache_key(url, size, fmt)
+    path = _qr_cache_path(cache_key, fmt)
+    cached = os.path.exists(path)
+    record_cache_lookup('qr', cached)
+    if not cached:
+        with timed_stage('qr'):
+            _store_qr_code(path, generate_qr_code(url, size, fmt))
+    return path, cache_key
+
+
+def get_qr_codes(urls, size=QR_DEFAULT_SIZE, fmt='png'):
+    """
+    Ko'p URL uchun QR kodlar; keshda yo'qlari process pool da parallel yaratiladi.
+
+    Natija: URL -> fayl yo'li.
+    """
+    paths = {}
+    missing = []
+    for url in urls:
+        path = _qr_cache_path(_qr_cache_key(url, size, fmt), fmt)
+        paths[url] = path
+        if not os.path.exists(path):
+            missing.append(url)
+    metrics.inc('shahodatnoma_cache_requests_total', len(urls) - len(missing), cache='qr', result='hit')
+    metrics.inc('shahodatnoma_cache_requests_total', len(missing), cache='qr', result='miss')
+
+    with timed_stage('qr'):
+        if len(missing) < QR_POOL_THRESHOLD or app.config['QR_WORKERS'] <= 0:
+            for url in missing:
+                _store_qr_code(paths[url], generate_qr_code(url, size, fmt))
+            return paths
+
+        futures = {
+            url: submit_to_process_pool('qr', app.config['QR_WORKERS'], generate_qr_code, url, size, fmt)
+            for url in missing
+        }
+        for url, future in futures.items():
+            _store_qr_code(paths[url], future.result())
+    return paths
+
+
+def parse_qr_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return QR_DEFAULT_SIZE
+    return min(max(size, QR_SIZE_RANGE[0]), QR_SIZE_RANGE[1])
+
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def submit_to_process_pool(pool_name, max_workers, fn, *args):
+    """
+    Vazifani nomlangan process pool ga topshiradi (pool birinchi chaqiruvda yaratiladi).
+
+    Pool lar har bir gunicorn worker ichida fork dan keyin alohida yaratiladi.
+    Pool buzilgan bo'lsa (jarayon yiqilgan), yangisi yaratilib qayta urinadi.
+    """
+    for attempt in range(2):
+        with _process_pools_lock:
+            pool = _process_pools.get(pool_name)
+            if pool is None:
+                pool = _process_pools[pool_name] = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:
+            with _process_pools_lock:
+                if _process_pools.get(pool_name) is pool:
+                    del _process_pools[pool_name]
+            if attempt:
+                raise
+
+
+def shutdown_process_pools():
+    """Barcha process pool larni yopish (CLI buyruqlari vazifalar tugashini kutishi uchun)"""
+    with _process_pools_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+    # Pool natijalari yakunlash oqimida yoziladi - ularni ham kutamiz
+    _job_results.join()
+
+
+# Future callback lari pool ning boshqaruv oqimida ishlaydi: u yerda sekin DB commit yoki S3 yuklash
+# boshqa natijalarni ushlab qoladi. Shuning uchun callback faqat navbatga qo'yadi, yakunlash esa
+# alohida oqimda bajariladi
+_job_results = queue.Queue()
+_job_results_thread = None
+_job_results_lock = threading.Lock()
+
+
+def _job_results_loop():
+    while True:
+        finish, args, kwargs = _job_results.get()
+        try:
+            with app.app_context():
+                finish(*args, **kwargs)
+        except Exception:
+            app.logger.exception("Fon vazifasi natijasini yozib bo'lmadi")
+        finally:
+            _job_results.task_done()
+
+
+def defer_job_finish(finish, *args, **kwargs):
+    """Vazifa natijasini yakunlash oqimiga topshirish (future callback idan chaqiriladi)"""
+    global _job_results_thread
+    with _job_results_lock:
+        # fork dan keyin ota jarayondagi oqim bolada ishlamaydi
+        if _job_results_thread is None or not _job_results_thread.is_alive():
+            _job_results_thread = threading.Thread(
+                target=_job_results_loop, name='shahodatnoma-job-results', daemon=True
+            )
+            _job_results_thread.start()
+    _job_results.put((finish, args, kwargs))
+
+
+RENDER_MANIFEST = 'manifest.json'
+PDF_METADATA_FILE = 'meta.json'
+# URL kengaytmasi -> (Pillow formati, MIME turi)
+PAGE_IMAGE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+Image.init()
+if 'AVIF' in Image.SAVE:  # Pillow AVIF bilan yig'ilgan bo'lsa
+    PAGE_IMAGE_FORMATS['avif'] = ('AVIF', 'image/avif')
+# <picture> ichidagi <source> tartibi (eng samarali birinchi); jpg - eski qurilmalar uchun
+PAGE_IMAGE_SOURCE_FORMATS = tuple(fmt for fmt in ('avif', 'webp') if fmt in PAGE_IMAGE_FORMATS)
+# Variant nomi -> rasm kengligi (piksel)
+PAGE_IMAGE_VARIANTS = {
+    'thumb': 320,
+    '1x': 900,
+    '2x': 1800,
+}
+PAGE_IMAGE_DEFAULT_VARIANT = '1x'
+PAGE_IMAGE_QUALITY_RANGE = (40, 85)
+PAGE_IMAGE_MAX_AGE = 365 * 24 * 3600
+# Render qulfi muddati - jarayon yiqilsa ham qulf abadiy qolib ketmasligi uchun
+RENDER_LOCK_TTL = 600
+
+_render_jobs = {}
+_render_lock = threading.Lock()
+# RENDER_WORKERS=0: sinxron render hujjat qulfi ostida - boshqa hujjatlar so'rovlari kutib qolmaydi
+_render_document_locks = weakref.WeakValueDictionary()
+# /img so'rovida render qilinayotgan sahifa variantlari: hujjat:sahifa:variant.format -> qulf
+_render_page_locks = weakref.WeakValueDictionary()
+# Sahifani boshqa worker yoki fon render vazifasi yozayotgan bo'lsa, o'zimiz render qilishdan oldin kutish (soniya)
+PAGE_RENDER_WAIT = 3
+
+
+def _write_json_atomic(path, payload):
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as json_file:
+        json.dump(payload, json_file)
+    os.replace(temp_path, path)
+
+
+def _page_image_path(image_dir, page_number, variant, fmt):
+    return os.path.join(image_dir, f'page_{page_number}_{variant}.{fmt}')
+
+
+def dzi_tag():
+    """Plitka geometriyasi belgisi - sozlama o'zgarsa URL ham o'zgaradi (eski kesh ishlatilmaydi)"""
+    return f"{app.config['DZI_TILE_SIZE']}-{app.config['DZI_OVERLAP']}-{app.config['DZI_MAX_SCALE']:g}"
+
+
+def _dzi_geometry(metadata, page_number):
+    """Sahifaning eng katta darajadagi o'lchami va darajalar soni (DZI: 0-daraja - 1x1 piksel)"""
+    width, height = metadata['sizes'][page_number - 1]
+    scale = app.config['DZI_MAX_SCALE']
+    full_width, full_height = max(round(width * scale), 1), max(round(height * scale), 1)
+    max_level = math.ceil(math.log2(max(full_width, full_height)))
+    return full_width, full_height, max_level
+
+
+def _dzi_level_size(full_width, full_height, max_level, level):
+    factor = 2 ** (max_level - level)
+    return max(math.ceil(full_width / factor), 1), max(math.ceil(full_height / factor), 1)
+
+
+def _dzi_tile_box(level_width, level_height, column, row):
+    """Plitkaning daraja ichidagi piksel chegaralari (ustma-ustlik bilan); mavjud bo'lmasa None"""
+    tile_size, overlap = app.config['DZI_TILE_SIZE'], app.config['DZI_OVERLAP']
+    left, top = column * tile_size, row * tile_size
+    if left >= level_width or top >= level_height:
+        return None
+    return (
+        max(left - overlap, 0),
+        max(top - overlap, 0),
+        min(left + tile_size + overlap, level_width),
+        min(top + tile_size + overlap, level_height),
+    )
+
+
+def _dzi_tile_path(image_dir, page_number, level, column, row, fmt):
+    return os.path.join(image_dir, f'dzi-{dzi_tag()}', str(page_number), str(level), f'{column}_{row}.{fmt}')
+
+
+def _render_dzi_tile(pdf_path, page_number, level_size, box, fmt, tile_path):
+    """Faqat plitka sohasini (clip) kerakli masshtabda render qilib, atomik yozish"""
+    level_width, level_height = level_size
+    left, top, right, bottom = box
+    with fitz.open(pdf_path) as pdf:
+        page = pdf[page_number - 1]
+        scale_x = level_width / page.rect.width
+        scale_y = level_height / page.rect.height
+        clip = fitz.Rect(
+            page.rect.x0 + left / scale_x,
+            page.rect.y0 + top / scale_y,
+            page.rect.x0 + right / scale_x,
+            page.rect.y0 + bottom / scale_y,
+        )
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale_x, scale_y), clip=clip, alpha=False)
+        image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+    # Yaxlitlash tufayli 1 piksel farq bo'lishi mumkin - plitka o'lchami aniq bo'lishi kerak
+    if image.size != (right - left, bottom - top):
+        image = image.resize((right - left, bottom - top), Image.LANCZOS)
+
+    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+    temp_path = f'{tile_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    image.save(temp_path, PAGE_IMAGE_FORMATS[fmt][0], quality=app.config['DZI_TILE_QUALITY'])
+    os.replace(temp_path, tile_path)
+
+
+def _page_image_budget(variant, budget):
+    scale = PAGE_IMAGE_VARIANTS[variant] / PAGE_IMAGE_VARIANTS[PAGE_IMAGE_DEFAULT_VARIANT]
+    return max(int(budget * scale * scale), 8 * 1024)
+
+
+def _page_to_image(page, width):
+    zoom = width / page.rect.width
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+
+def _encode_page_image(image, fmt, budget):
+    """
+    Rasmni byudjetga sig'adigan eng yuqori sifat bilan kodlaydi.
+
+    Matnli shahodatnomalar odatda maksimal sifatda ham byudjetga sig'adi,
+    shuning uchun avval shu tekshiriladi; aks holda sifat ikkiga bo'lib qidiriladi.
+    """
+    pil_format = PAGE_IMAGE_FORMATS[fmt][0]
+
+    def encode(quality):
+        buffered = BytesIO()
+        if pil_format == 'JPEG':
+            image.save(buffered, format=pil_format, quality=quality, optimize=True, progressive=True)
+        else:
+            image.save(buffered, format=pil_format, quality=quality)
+        return buffered.getvalue()
+
+    low, high = PAGE_IMAGE_QUALITY_RANGE
+    data = encode(high)
+    if len(data) <= budget:
+        return data
+
+    best = None
+    high -= 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = encode(quality)
+        if len(candidate) <= budget:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else encode(PAGE_IMAGE_QUALITY_RANGE[0])
+
+
+def _write_page_image(image, image_path, fmt, budget):
+    temp_path = f'{image_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as image_file:
+        image_file.write(_encode_page_image(image, fmt, budget))
+    os.replace(temp_path, image_path)
+
+
+def _render_pdf_page(pdf, page_number, image_dir, variant, fmt, budget):
+    """Bitta sahifaning bitta variantini render qilib, faylga atomik tarzda yozadi."""
+    image = _page_to_image(pdf[page_number - 1], PAGE_IMAGE_VARIANTS[variant])
+    image_path = _page_image_path(image_dir, page_number, variant, fmt)
+    os.makedirs(image_dir, exist_ok=True)
+    _write_page_image(image, image_path, fmt, _page_image_budget(variant, budget))
+    return image_path
+
+
+def _render_pdf_pages(pdf_path, image_dir, budget):
+    """
+    PDF ning hali tayyor bo'lmagan sahifa rasmlarini yaratadi (process pool ichida).
+
+    Har bir sahifa bir marta eng katta kenglikda render qilinadi, qolgan
+    variantlar undan kichraytiriladi. Manifest eng oxirida yoziladi, shuning
+    uchun manifest mavjud bo'lsa - barcha rasmlar tayyor.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    variants = sorted(PAGE_IMAGE_VARIANTS.items(), key=lambda item: item[1], reverse=True)
+    with fitz.open(pdf_path) as pdf:
+        page_count = pdf.page_count
+        for page_number in range(1, page_count + 1):
+            missing = [
+                (variant, fmt)
+                for variant, _ in variants
+                for fmt in PAGE_IMAGE_FORMATS
+                if not os.path.exists(_page_image_path(image_dir, page_number, variant, fmt))
+            ]
+            if not missing:
+                continue
+
+            source = _page_to_image(pdf[page_number - 1], variants[0][1])
+            for variant, width in variants:
+                image = source
+                if width != source.width:
+                    height = max(round(source.height * width / source.width), 1)
+                    image = source.resize((width, height), Image.LANCZOS)
+                for fmt in PAGE_IMAGE_FORMATS:
+                    if (variant, fmt) in missing:
+                        _write_page_image(
+                            image,
+                            _page_image_path(image_dir, page_number, variant, fmt),
+                            fmt,
+                            _page_image_budget(variant, budget)
+                        )
+
+    _write_json_atomic(os.path.join(image_dir, RENDER_MANIFEST), {'pages': page_count})
+    return page_count
+
+
+def _render_paths(filename):
+    base_name = os.path.splitext(filename)[0]
+    pdf_path = pdf_storage.local_path(filename)
+    image_dir = os.path.join(app.config['STATIC_PDF_IMAGE_FOLDER'], base_name)
+    return base_name, pdf_path, image_dir
+
+
+def _read_render_manifest(image_dir):
+    try:
+        with open(os.path.join(image_dir, RENDER_MANIFEST), encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _load_pdf_metadata(filename):
+    _, pdf_path, image_dir = _render_paths(filename)
+    metadata_path = os.path.join(image_dir, PDF_METADATA_FILE)
+    try:
+        with open(metadata_path, encoding='utf-8') as metadata_file:
+            return json.load(metadata_file)
+    except (OSError, ValueError):
+        pass
+
+    with fitz.open(pdf_path) as pdf:
+        sizes = [[round(page.rect.width), round(page.rect.height)] for page in pdf]
+    metadata = {'pages': len(sizes), 'sizes': sizes}
+    os.makedirs(image_dir, exist_ok=True)
+    _write_json_atomic(metadata_path, metadata)
+    return metadata
+
+
+def get_pdf_metadata(filename):
+    """
+    PDF sahifalari soni va o'lchamlarini qaytaradi (xotira va diskda keshlanadi).
+
+    Fayl nomi har bir yuklashda yangi bo'lgani uchun keshni tozalash shart emas.
+    """
+    if fitz is None or not filename:
+        return None
+    try:
+        # Obyekt omborida bo'lsa, render yo'llari uchun lokal nusxa shu yerda tayyorlanadi
+        if pdf_storage.fetch(filename) is None:
+            return None
+        return _load_pdf_metadata(filename)
+    except Exception:
+        return None
+
+
+def enqueue_pdf_render(filename):
+    """
+    PDF sahifalarini fon rejimida rasmga aylantirish uchun navbatga qo'yadi.
+
+    Bir hujjat uchun bir vaqtda faqat bitta vazifa ishlaydi - parallel
+    so'rovlar mavjud vazifani qaytarib oladi. Rasmlar tayyor bo'lsa None.
+    """
+    if fitz is None or not filename:
+        return None
+
+    base_name, pdf_path, image_dir = _render_paths(filename)
+    if _read_render_manifest(image_dir) is not None or pdf_storage.fetch(filename) is None:
+        return None
+
+    budget = app.config['PAGE_IMAGE_BYTE_BUDGET']
+    if app.config['RENDER_WORKERS'] <= 0:
+        with _render_lock:
+            document_lock = _render_document_locks.get(base_name)
+            if document_lock is None:
+                document_lock = _render_document_locks[base_name] = threading.Lock()
+        with document_lock:
+            # Kutish davomida boshqa so'rov render qilib bo'lgan bo'lishi mumkin
+            if _read_render_manifest(image_dir) is None:
+                try:
+                    with timed_stage('render'):
+                        _render_pdf_pages(pdf_path, image_dir, budget)
+                except Exception:
+                    pass
+        return None
+
+    with _render_lock:
+        future = _render_jobs.get(base_name)
+        if future is not None:
+            return future
+
+        # Boshqa worker shu hujjatni render qilayotgan bo'lsa, qayta boshlamaymiz
+        lock_key = f'shahodatnoma:render-lock:{base_name}'
+        if not cache_backend.add(lock_key, str(os.getpid()), RENDER_LOCK_TTL):
+            return None
+
+        submitted = time.perf_counter()
+        future = submit_to_process_pool(
+            'render', app.config['RENDER_WORKERS'], _render_pdf_pages, pdf_path, image_dir, budget
+        )
+
+        _render_jobs[base_name] = future
+
+    def _forget(_future, key=base_name):
+        # Navbatda kutish bilan birga to'liq vaqt
+        record_stage('render_job', time.perf_counter() - submitted)
+        with _render_lock:
+            if _render_jobs.get(key) is _future:
+                del _render_jobs[key]
+        cache_backend.delete(lock_key)
+
+    future.add_done_callback(_forget)
+    return future
+
+
+def _try_cache_backend(method, *args):
+    try:
+        return method(*args)
+    except Exception:
+        return None
+
+
+def render_page_on_demand(filename, page, variant, fmt):
+    """
+    Sahifa rasmini so'rov ichida render qilish (tayyor bo'lsa - darhol); fayl yo'li yoki None.
+
+    Bir sahifa varianti bir vaqtda bir marta render qilinadi: jarayon ichida sahifa
+    qulfi, workerlar o'rtasida cache_backend qulfi. Qulf boshqa workerda bo'lsa yoki
+    hujjatning fon render vazifasi ishlayotgan bo'lsa, fayl PAGE_RENDER_WAIT gacha kutiladi.
+    """
+    base_name, pdf_path, image_dir = _render_paths(filename)
+    image_path = _page_image_path(image_dir, page, variant, fmt)
+    if os.path.exists(image_path):
+        return image_path
+
+    page_key = f'{base_name}:{page}:{variant}.{fmt}'
+    with _render_lock:
+        page_lock = _render_page_locks.get(page_key)
+        if page_lock is None:
+            page_lock = _render_page_locks[page_key] = threading.Lock()
+        document_job_running = base_name in _render_jobs
+
+    with page_lock:
+        # Qulfni kutayotganda boshqa so'rov render qilib bo'lgan bo'lishi mumkin
+        if os.path.exists(image_path):
+            return image_path
+
+        lock_key = f'shahodatnoma:page-render-lock:{page_key}'
+        acquired = _try_cache_backend(cache_backend.add, lock_key, str(os.getpid()), RENDER_LOCK_TTL) is not False
+        if not acquired or document_job_running or _try_cache_backend(
+            cache_backend.get, f'shahodatnoma:render-lock:{base_name}'
+        ):
+            deadline = time.monotonic() + PAGE_RENDER_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                if os.path.exists(image_path):
+                    if acquired:
+                        _try_cache_backend(cache_backend.delete, lock_key)
+                    return image_path
+
+        try:
+            with timed_stage('render'), fitz.open(pdf_path) as pdf:
+                _render_pdf_page(pdf, page, image_dir, variant, fmt, app.config['PAGE_IMAGE_BYTE_BUDGET'])
+        except Exception:
+            return None
+        finally:
+            if acquired:
+                _try_cache_backend(cache_backend.delete, lock_key)
+    return image_path
+
+
+def get_pdf_page_images(filename: str):
+    """
+    Har bir PDF sahifasi uchun `<picture>` manbalari (srcset) va o'lchamlarini qaytaradi.
+
+    Rasmlar o'zi oldindan tayyorlanishi shart emas - `/img/...` endpointi
+    sahifani birinchi so'rovda render qiladi. Qolgan sahifalar fon
+    rejimida tayyorlanadi.
+    """
+    metadata = get_pdf_metadata(filename)
+    if not metadata or not metadata['pages']:
+        return []
+
+    if app.config['RENDER_WORKERS'] > 0:
+        enqueue_pdf_render(filename)
+
+    base_name = os.path.splitext(filename)[0]
+
+    def srcset(page_number, fmt):
+        return ', '.join(
+            f"{url_for('pdf_page_image', doc=base_name, page=page_number, variant=variant, fmt=fmt)} {width}w"
+            for variant, width in PAGE_IMAGE_VARIANTS.items()
+        )
+
+    return [
+        {
+            'url': url_for(
+                'pdf_page_image',
+                doc=base_name,
+                page=page_number,
+                variant=PAGE_IMAGE_DEFAULT_VARIANT,
+                fmt='jpg'
+            ),
+            'srcset': srcset(page_number, 'jpg'),
+            'sources': [
+                {'type': PAGE_IMAGE_FORMATS[fmt][1], 'srcset': srcset(page_number, fmt)}
+                for fmt in PAGE_IMAGE_SOURCE_FORMATS
+            ],
+            'width': width,
+            'height': height,
+            'zoom_url': url_for('pdf_page_zoom', doc=base_name, page=page_number),
+        }
+        for page_number, (width, height) in enumerate(metadata['sizes'], start=1)
+    ]
+
+
+def _spool_upload(file):
+    """
+    Yuklangan faylning vaqtinchalik yo'li va SHA-256 xeshini qaytaradi.
+
+    UploadRequest orqali kelgan fayl allaqachon diskda va xeshlangan;
+    boshqa holatda (masalan, BytesIO) oqim bo'laklab ko'chiriladi.
+    """
+    upload = file.stream
+    if isinstance(upload, HashingTemporaryFile):
+        upload.flush()
+        return upload.name, upload.sha256.hexdigest()
+
+    sha256 = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.upload', dir=app.config['UPLOAD_FOLDER']) as tmp:
+        g.setdefault('upload_temp_files', []).append(tmp.name)
+        for chunk in iter(lambda: upload.read(UPLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            tmp.write(chunk)
+    return tmp.name, sha256.hexdigest()
+
+
+def optimize_pdf(input_path, output_path):
+    """
+    PDF ni siqib, linearize qilib `output_path` ga atomik tarzda yozadi.
+
+    `input_path` va `output_path` bir xil bo'lishi mumkin (joyida almashtirish).
+    pikepdf bo'lmasa yoki fayl buzilgan bo'lsa, hech narsa yozilmaydi va False qaytadi.
+    """
+    if pikepdf is None:
+        return False
+
+    temp_output = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with pikepdf.open(input_path) as pdf:
+            save_kwargs = {'linearize': True}
+            compression_level = getattr(pikepdf, 'CompressionLevel', None)
+            if compression_level:
+                save_kwargs['compression'] = compression_level.default
+            try:
+                pdf.save(temp_output, optimize_streams=True, **save_kwargs)
+            except TypeError:
+                pdf.save(temp_output, **save_kwargs)
+    except Exception as exc:  # noqa: F841
+        try:
+            os.remove(temp_output)
+        except OSError:
+            pass
+        return False
+
+    os.replace(temp_output, output_path)
+    return True
+
+
+def store_upload(temp_path, stored_path):
+    """Vaqtinchalik faylni saqlash joyiga atomik ko'chirish (UPLOAD_FOLDER boshqa diskda bo'lishi mumkin)"""
+    temp_output = f'{stored_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.move(temp_path, temp_output)
+    os.replace(temp_output, stored_path)
+
+
+class LocalPDFStorage:
+    """PDF lar STATIC_PDF_FOLDER da saqlanadi - lokal fayl asl nusxaning o'zi."""
+
+    remote = False
+
+    def local_path(self, name):
+        return os.path.join(app.config['STATIC_PDF_FOLDER'], name)
+
+    def exists(self, name):
+        return os.path.isfile(self.local_path(name))
+
+    def save(self, source_path, name):
+        """Faylni saqlash joyiga ko'chirish (source_path o'zi saqlash joyi bo'lsa - hech narsa qilmaydi)"""
+        target = self.local_path(name)
+        if os.path.abspath(source_path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            store_upload(source_path, target)
+
+    def fetch(self, name):
+        """O'qish uchun lokal fayl yo'li (fayl bo'lmasa None)"""
+        path = self.local_path(name)
+        return path if os.path.isfile(path) else None
+
+    def delete(self, name):
+        try:
+            os.remove(self.local_path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        """Saqlangan PDF lar: (nom, o'zgartirilgan vaqt) juftliklari"""
+        with os.scandir(app.config['STATIC_PDF_FOLDER']) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.pdf'):
+                    yield entry.name, entry.stat().st_mtime
+
+
+class S3PDFStorage(LocalPDFStorage):
+    """
+    PDF lar S3 ga mos obyekt omborida saqlanadi (AWS S3, MinIO, Ceph RGW va h.k.).
+
+    STATIC_PDF_FOLDER lokal kesh: fayl birinchi so'rovda yuklab olinadi va
+    keyin diskdan uzatiladi (sendfile, X-Accel-Redirect o'zgarishsiz ishlaydi).
+    Lokal nusxalar hosila fayllar qatorida LRU bo'yicha tozalanadi. Testlarda
+    `client` o'rniga boto3 S3 API ga mos lokal obyekt berish mumkin.
+    """
+
+    remote = True
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    @classmethod
+    def from_config(cls, config):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 uchun 'boto3' paketi o'rnatilmagan")
+        if not config['S3_BUCKET']:
+            raise RuntimeError("STORAGE_BACKEND=s3 uchun S3_BUCKET ko'rsatilishi kerak")
+        client = boto3.client(
+            's3', endpoint_url=config['S3_ENDPOINT_URL'], region_name=config['S3_REGION']
+        )
+        return cls(client, config['S3_BUCKET'], config['S3_PREFIX'])
+
+    def _key(self, name):
+        return f'{self.prefix}{name}'
+
+    @staticmethod
+    def _is_missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def exists(self, name):
+        if super().exists(name):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as error:
+            if self._is_missing(error):
+                return False
+            raise
+        return True
+
+    def save(self, source_path, name):
+        self.client.upload_file(source_path, self.bucket, self._key(name))
+        super().save(source_path, name)
+
+    def fetch(self, name):
+        path = super().fetch(name)
+        if path is not None:
+            return path
+        if '/' in name or name.startswith('.'):
+            return None
+        path = self.local_path(name)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            self.client.download_file(self.bucket, self._key(name), temp_path)
+        except ClientError as error:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if self._is_missing(error):
+                return None
+            raise
+        os.replace(temp_path, path)
+        return path
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+        super().delete(name)
+
+    def list(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                if name.endswith('.pdf') and '/' not in name:
+                    yield name, item['LastModified'].timestamp()
+
+
+def create_pdf_storage(config):
+    """Konfiguratsiyadagi STORAGE_BACKEND bo'yicha PDF saqlash joyini yaratish"""
+    if config['STORAGE_BACKEND'] == 's3':
+        return S3PDFStorage.from_config(config)
+    return LocalPDFStorage()
+
+
+pdf_storage = create_pdf_storage(app.config)
+
+
+def _optimize_stored_pdf(stored_path):
+    """Process pool ichida: saqlangan PDF ni joyida optimallashtirish"""
+    if not os.path.exists(stored_path):
+        raise FileNotFoundError(stored_path)
+    return optimize_pdf(stored_path, stored_path)
+
+
+def _set_documents_status(content_hash, status):
+    Document.query.filter_by(content_hash=content_hash).update(
+        {'status': status}, synchronize_session=False
+    )
+
+
+def enqueue_optimize_job(content_hash):
+    """
+    Saqlangan PDF ni fon rejimida optimallashtirish uchun vazifa yaratadi.
+
+    Optimizatsiya tugaguncha asl fayl beriladi; tayyor bo'lgach fayl atomik
+    almashtiriladi. Chaqiruvchi tranzaksiyani o'zi commit qiladi.
+    """
+    job = ProcessingJob(kind='optimize', content_hash=content_hash, status='pending')
+    db.session.add(job)
+    _set_documents_status(content_hash, 'pending')
+    return job
+
+
+def _claim_job(job_id):
+    """Vazifani 'running' holatiga o'tkazish; boshqa worker allaqachon olgan bo'lsa False"""
+    claimed = ProcessingJob.query.filter_by(id=job_id, status='pending').update(
+        {'status': 'running', 'attempts': ProcessingJob.attempts + 1, 'updated_at': db.func.now()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return claimed == 1
+
+
+def _finish_optimize_job(job_id, content_hash, succeeded, error=None):
+    stored_filename = f'{content_hash}.pdf'
+    if succeeded and pdf_storage.remote:
+        # Joyida siqilgan lokal nusxani obyekt omboriga qayta yozish
+        pdf_storage.save(pdf_storage.local_path(stored_filename), stored_filename)
+
+    job = db.session.get(ProcessingJob, job_id)
+    if job is not None:
+        job.status = 'done' if error is None else 'failed'
+        job.error = error
+    _set_documents_status(content_hash, 'ready' if succeeded else 'failed')
+    db.session.commit()
+
+    # Optimizatsiya davomida hujjat boshqa fayl bilan almashtirilgan bo'lishi mumkin
+    release_pdf_file(stored_filename)
+
+
+def run_processing_job(job_id, pool_name='optimize', max_workers=None):
+    """Vazifani process pool ga topshirish (OPTIMIZE_WORKERS=0 bo'lsa - shu yerda bajarish)"""
+    job = db.session.get(ProcessingJob, job_id)
+    if job is None or not _claim_job(job_id):
+        return None
+
+    content_hash = job.content_hash
+    if job.kind == TEXT_JOB_KIND:
+        return _run_text_job(job_id, content_hash)
+
+    _set_documents_status(content_hash, 'optimizing')
+    db.session.commit()
+    stored_filename = f'{content_hash}.pdf'
+    stored_path = pdf_storage.fetch(stored_filename) or pdf_storage.local_path(stored_filename)
+
+    if app.config['OPTIMIZE_WORKERS'] <= 0:
+        try:
+            with timed_stage('optimize'):
+                succeeded = _optimize_stored_pdf(stored_path)
+        except Exception as exc:
+            _finish_optimize_job(job_id, content_hash, False, error=repr(exc))
+        else:
+            _finish_optimize_job(job_id, content_hash, succeeded)
+        return None
+
+    submitted = time.perf_counter()
+    future = submit_to_process_pool(
+        pool_name, max_workers or app.config['OPTIMIZE_WORKERS'], _optimize_stored_pdf, stored_path
+    )
+
+    def _done(_future):
+        record_stage('optimize_job', time.perf_counter() - submitted)
+        error = _future.exception()
+        if error is not None:
+            defer_job_finish(_finish_optimize_job, job_id, content_hash, False, error=repr(error))
+        else:
+            defer_job_finish(_finish_optimize_job, job_id, content_hash, _future.result())
+
+    future.add_done_callback(_done)
+    return future
+
+
+TEXT_JOB_KIND = 'extract_text'
+
+
+def _extract_pdf_text(pdf_path, max_chars):
+    """Process pool ichida: PDF sahifalari matni (bo'shliqlar siqilgan), (sahifalar soni, matn)"""
+    with fitz.open(pdf_path) as pdf:
+        pages = [' '.join(page.get_text('text').split()) for page in pdf]
+    return len(pages), '\n'.join(page for page in pages if page)[:max_chars]
+
+
+def enqueue_text_job(content_hash):
+    """
+    PDF matnini qidiruv indeksiga yozish vazifasini yaratadi (chaqiruvchi commit qiladi).
+
+    Bir xil fayl uchun matn allaqachon bo'lsa yoki vazifa navbatda bo'lsa None.
+    """
+    if fitz is None:
+        return None
+    if db.session.query(DocumentText.id).filter_by(content_hash=content_hash).first() is not None:
+        return None
+    pending = ProcessingJob.query.filter(
+        ProcessingJob.kind == TEXT_JOB_KIND,
+        ProcessingJob.content_hash == content_hash,
+        ProcessingJob.status.in_(('pending', 'running')),
+    ).first()
+    if pending is not None:
+        return None
+    job = ProcessingJob(kind=TEXT_JOB_KIND, content_hash=content_hash, status='pending')
+    db.session.add(job)
+    return job
+
+
+def _finish_text_job(job_id, content_hash, result, error=None):
+    job = db.session.get(ProcessingJob, job_id)
+    if job is not None:
+        job.status = 'done' if error is None else 'failed'
+        job.error = error
+    if result is not None:
+        page_count, body = result
+        entry = DocumentText.query.filter_by(content_hash=content_hash).first()
+        if entry is None:
+            db.session.add(DocumentText(content_hash=content_hash, body=body, page_count=page_count))
+        else:
+            entry.body, entry.page_count = body, page_count
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Shu fayl matnini boshqa vazifa allaqachon yozgan
+        db.session.rollback()
+        ProcessingJob.query.filter_by(id=job_id).update({'status': 'done'}, synchronize_session=False)
+        db.session.commit()
+
+    # Ajratish davomida fayl o'chirilgan bo'lsa, matn ham kerak emas
+    if not pdf_storage.exists(f'{content_hash}.pdf'):
+        remove_text_index(content_hash)
+
+
+def _run_text_job(job_id, content_hash):
+    """Matn ajratishni process pool ga topshirish (TEXT_WORKERS=0 bo'lsa - shu yerda)"""
+    stored_filename = f'{content_hash}.pdf'
+    pdf_path = pdf_storage.fetch(stored_filename) or pdf_storage.local_path(stored_filename)
+    max_chars = app.config['TEXT_INDEX_MAX_CHARS']
+
+    if app.config['TEXT_WORKERS'] <= 0:
+        try:
+            with timed_stage('extract'):
+                result = _extract_pdf_text(pdf_path, max_chars)
+        except Exception as exc:
+            _finish_text_job(job_id, content_hash, None, error=repr(exc))
+        else:
+            _finish_text_job(job_id, content_hash, result)
+        return None
+
+    submitted = time.perf_counter()
+    future = submit_to_process_pool(
+        'text', app.config['TEXT_WORKERS'], _extract_pdf_text, pdf_path, max_chars
+    )
+
+    def _done(_future):
+        record_stage('extract_job', time.perf_counter() - submitted)
+        error = _future.exception()
+        if error is not None:
+            defer_job_finish(_finish_text_job, job_id, content_hash, None, error=repr(error))
+        else:
+            defer_job_finish(_finish_text_job, job_id, content_hash, _future.result())
+
+    future.add_done_callback(_done)
+    return future
+
+
+def remove_text_index(content_hash):
+    """Fayl o'chirilganda uning matnini qidiruv indeksidan olib tashlash"""
+    DocumentText.query.filter_by(content_hash=content_hash).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def resume_processing_jobs():
+    """Worker yiqilishi sababli tugallanmay qolgan vazifalarni qayta navbatga qo'yish"""
+    # updated_at bazada db.func.now() bilan yoziladi (SQLite da UTC) - chegarani ham baza soatidan olamiz,
+    # aks holda server vaqt zonasi UTC dan farq qilganda ishlayotgan vazifalar "eskirgan" hisoblanadi
+    database_now = db.session.query(db.func.now()).scalar()
+    stale_before = database_now - timedelta(seconds=app.config['JOB_STALE_SECONDS'])
+    ProcessingJob.query.filter(
+        ProcessingJob.status == 'running',
+        ProcessingJob.updated_at < stale_before
+    ).update({'status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+    for (job_id,) in db.session.query(ProcessingJob.id).filter_by(status='pending').all():
+        run_processing_job(job_id)
+
+
+def remove_derived_files(filename):
+    """PDF dan hosil qilingan sahifa rasmlari, DZI plitkalar va metadata papkasini o'chirish"""
+    _, _, image_dir = _render_paths(filename)
+    shutil.rmtree(image_dir, ignore_errors=True)
+
+
+# Umumiy PDF ga havola qo'shish (upload dedup) va uni o'chirish (release) navbatma-navbat bajariladi
+BLOB_LOCK_TTL = 60
+
+
+@contextmanager
+def pdf_blob_lock(filename, timeout=BLOB_LOCK_TTL):
+    """Saqlangan PDF uchun workerlar o'rtasidagi qulf (backend ishlamasa - qulfsiz davom etiladi)"""
+    lock_key = f'shahodatnoma:blob-lock:{filename}'
+    deadline = time.monotonic() + timeout
+    acquired = False
+    while True:
+        try:
+            acquired = cache_backend.add(lock_key, f'{os.getpid()}:{threading.get_ident()}', BLOB_LOCK_TTL)
+        except Exception:
+            break
+        if acquired or time.monotonic() >= deadline:
+            break
+        time.sleep(0.02)
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                cache_backend.delete(lock_key)
+            except Exception:
+                pass
+
+
+def release_pdf_file(filename):
+    """Hech bir hujjat ishlatmayotgan PDF faylni va uning rasmlarini o'chirish (bir fayl bir nechta username ga tegishli bo'lishi mumkin)"""
+    with pdf_blob_lock(filename):
+        # Alohida ulanish: chaqiruvchi sessiyaning eski snapshot i emas, oxirgi commit lar ko'rinadi
+        with db.engine.connect() as connection:
+            references = connection.execute(
+                db.select(db.func.count()).select_from(Document).where(Document.filename == filename)
+            ).scalar()
+        if references:
+            return False
+        pdf_storage.delete(filename)
+    remove_derived_files(filename)
+    remove_text_index(os.path.splitext(filename)[0])
+    return True
+
+
+GC_LOCK_KEY = 'shahodatnoma:gc-lock'
+# Yiqilgan yuklash/render jarayonlaridan qolishi mumkin bo'lgan vaqtinchalik fayllar
+TEMP_FILE_SUFFIXES = ('.upload', '.tmp')
+# LRU tozalashda tegilmaydigan kichik xizmat fayllari (ular yo'qolsa barcha sahifalar qayta render qilinadi)
+EVICTION_EXEMPT_FILES = (RENDER_MANIFEST, PDF_METADATA_FILE)
+
+
+def referenced_pdf_files():
+    """GC havola indeksi: hujjatlar va tugallanmagan vazifalar ishlatayotgan PDF nomlari"""
+    names = {
+        filename
+        for (filename,) in db.session.query(Document.filename).filter(
+            Document.filename != None  # noqa: E711
+        ).distinct()
+    }
+    active_jobs = db.session.query(ProcessingJob.content_hash).filter(
+        ProcessingJob.status.in_(('pending', 'running'))
+    )
+    names.update(f'{content_hash}.pdf' for (content_hash,) in active_jobs)
+    return names
+
+
+def _iter_files(root):
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                yield path, os.stat(path)
+            except FileNotFoundError:
+                continue
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict_derived_files(max_bytes, dry_run=False):
+    """
+    Hosila fayllar hajmi max_bytes dan oshsa, eng uzoq ishlatilmaganlarini o'chirish (LRU).
+
+    Sahifa rasmlari, DZI plitkalar, QR kesh va (S3 rejimida) PDF larning lokal
+    nusxalari kerak bo'lganda qayta yaratiladi. Murojaat vaqti - atime va mtime
+    ning kattasi. Hajm chegaraning 90% iga tushguncha o'chiriladi, shunda har
+    bir o'tishda tozalash qayta boshlanmaydi. (jami, o'chirilgan soni, baytlar) qaytaradi.
+    """
+    roots = [app.config['STATIC_PDF_IMAGE_FOLDER'], app.config['QR_CACHE_FOLDER']]
+    if pdf_storage.remote:
+        roots.append(app.config['STATIC_PDF_FOLDER'])
+
+    candidates = []
+    total = 0
+    for root in roots:
+        for path, stat in _iter_files(root):
+            total += stat.st_size
+            if os.path.basename(path) not in EVICTION_EXEMPT_FILES:
+                candidates.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+    evicted = freed = 0
+    if max_bytes <= 0 or total <= max_bytes:
+        return total, evicted, freed
+
+    target = max_bytes * 0.9
+    candidates.sort()
+    for _, size, path in candidates:
+        if total - freed <= target:
+            break
+        if not dry_run:
+            _remove_file(path)
+        evicted += 1
+        freed += size
+    return total, evicted, freed
+
+
+def collect_garbage(dry_run=False):
+    """
+    Yetim fayllarni yig'ish va kesh papkalarini ixchamlash.
+
+    Hech bir hujjat ishlatmayotgan PDF lar va rasm papkalari, yiqilgan
+    jarayonlardan qolgan vaqtinchalik fayllar o'chiriladi, kesh backendi
+    tozalanadi va hosila fayllar DERIVED_CACHE_MAX_BYTES ga tushiriladi.
+    GC_GRACE_SECONDS dan yangi fayllarga tegilmaydi - ular hali yozilayotgan
+    yoki commit qilinmagan yuklash bo'lishi mumkin. Hisobot dict qaytaradi.
+    """
+    now = time.time()
+    grace = app.config['GC_GRACE_SECONDS']
+    referenced = referenced_pdf_files()
+    report = {'dry_run': dry_run, 'orphan_pdfs': [], 'orphan_image_dirs': [], 'orphan_texts': 0, 'temp_files': []}
+
+    def expired(mtime):
+        return now - mtime > grace
+
+    for name, mtime in list(pdf_storage.list()):
+        if name not in referenced and expired(mtime):
+            report['orphan_pdfs'].append(name)
+            if not dry_run:
+                # Havola shu orada paydo bo'lgan bo'lishi mumkin - release_pdf_file qayta tekshiradi
+                release_pdf_file(name)
+    if pdf_storage.remote:
+        # Ombordan allaqachon o'chirilgan fayllarning lokal nusxalari
+        for name, mtime in list(LocalPDFStorage.list(pdf_storage)):
+            if name not in referenced and expired(mtime) and name not in report['orphan_pdfs']:
+                report['orphan_pdfs'].append(name)
+                if not dry_run:
+                    _remove_file(pdf_storage.local_path(name))
+
+    with os.scandir(app.config['STATIC_PDF_IMAGE_FOLDER']) as entries:
+        orphan_dirs = [
+            entry for entry in entries
+            if entry.is_dir() and f'{entry.name}.pdf' not in referenced and expired(entry.stat().st_mtime)
+        ]
+    for entry in orphan_dirs:
+        report['orphan_image_dirs'].append(entry.name)
+        if not dry_run:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    referenced_hashes = {os.path.splitext(name)[0] for name in referenced}
+    orphan_texts = [
+        content_hash for (content_hash,) in db.session.query(DocumentText.content_hash)
+        if content_hash not in referenced_hashes
+    ]
+    report['orphan_texts'] = len(orphan_texts)
+    if orphan_texts and not dry_run:
+        DocumentText.query.filter(DocumentText.content_hash.in_(orphan_texts)).delete(synchronize_session=False)
+        db.session.commit()
+
+    for root in (
+        app.config['UPLOAD_FOLDER'],
+        app.config['STATIC_PDF_FOLDER'],
+        app.config['STATIC_PDF_IMAGE_FOLDER'],
+        app.config['QR_CACHE_FOLDER'],
+    ):
+        for path, stat in list(_iter_files(root)):
+            if path.endswith(TEMP_FILE_SUFFIXES) and expired(stat.st_mtime):
+                report['temp_files'].append(os.path.relpath(path, root))
+                if not dry_run:
+                    _remove_file(path)
+
+    if not dry_run:
+        cache_backend.compact()
+
+    total, evicted, freed = evict_derived_files(app.config['DERIVED_CACHE_MAX_BYTES'], dry_run)
+    report.update(derived_bytes=total, evicted_files=evicted, evicted_bytes=freed)
+
+    if not dry_run:
+        metrics.inc('shahodatnoma_gc_removed_files_total', len(report['orphan_pdfs']), kind='orphan_pdf')
+        metrics.inc('shahodatnoma_gc_removed_files_total', len(report['orphan_image_dirs']), kind='orphan_images')
+        metrics.inc('shahodatnoma_gc_removed_files_total', len(report['temp_files']), kind='temp')
+        metrics.inc('shahodatnoma_gc_removed_files_total', evicted, kind='evicted')
+        metrics.inc('shahodatnoma_gc_reclaimed_bytes_total', freed)
+        flush_metrics(force=True)
+    return report
+
+
+_gc_thread = None
+
+
+def _gc_loop(interval):
+    while True:
+        time.sleep(interval)
+        # Bitta o'tishni faqat bitta worker bajaradi (qulf GC_INTERVAL davomida ushlanadi)
+        try:
+            if not cache_backend.add(GC_LOCK_KEY, str(os.getpid()), interval):
+                continue
+            with app.app_context():
+                collect_garbage()
+        except Exception:
+            app.logger.exception("GC o'tishi muvaffaqiyatsiz tugadi")
+
+
+def start_gc_thread():
+    """Har bir workerda GC_INTERVAL oralig'ida ishlaydigan fon oqimini ishga tushirish"""
+    global _gc_thread
+    interval = app.config['GC_INTERVAL']
+    if interval <= 0 or _gc_thread is not None:
+        return
+    _gc_thread = threading.Thread(target=_gc_loop, args=(interval,), name='shahodatnoma-gc', daemon=True)
+    _gc_thread.start()
+
+
+def normalize_username(username):
+    """Username formatini tozalash (create_username va upload_pdf bilan bir xil qoida)"""
+    return secure_filename((username or '').strip()).lower().replace(' ', '')
+
+
+# /<username> dan oldin mos keladigan yo'llar - bunday username sahifasi hech qachon ochilmaydi
+RESERVED_USERNAMES = frozenset({'admin', 'metrics', 'favicon.ico'})
+
+
+# Arxivdagi bitta faylni o'qishda chiqadigan xatolar: shifrlangan (RuntimeError), qo'llab-quvvatlanmaydigan
+# siqish usuli (NotImplementedError), buzilgan yoki kesilgan ma'lumot - ular faqat shu qatorni xato qiladi
+ARCHIVE_MEMBER_ERRORS = (
+    ValueError, OSError, EOFError, RuntimeError, NotImplementedError, zipfile.BadZipFile, zlib.error
+)
+
+
+def _spool_archive_member(archive, member):
+    """ZIP ichidagi faylni butun arxivni ochmasdan vaqtinchalik faylga bo'laklab yozish va xeshlash"""
+    max_size = app.config['MAX_CONTENT_LENGTH']
+    sha256 = hashlib.sha256()
+    written = 0
+    with archive.open(member) as source, tempfile.NamedTemporaryFile(
+        delete=False, suffix='.upload', dir=app.config['UPLOAD_FOLDER']
+    ) as tmp:
+        try:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+                written += len(chunk)
+                if written > max_size:
+                    raise ValueError('fayl hajmi ruxsat etilganidan katta')
+                sha256.update(chunk)
+                tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name, sha256.hexdigest()
+
+
+def import_certificates(csv_text, archive=None):
+    """
+    CSV (username[,pdf]) va ZIP arxivdan username va PDF larni ommaviy import qilish.
+
+    Har bir PDF arxivdan bittadan o'qiladi, yangi fayllar siqish uchun
+    parallel process pool ga topshiriladi, DB ga esa barcha qatorlar bitta
+    tranzaksiyada executemany bilan yoziladi. Har bir qator uchun natija
+    ro'yxati va ishga tushirilgan vazifalar (future) qaytariladi.
+    """
+    reader = csv.DictReader(io.StringIO(csv_text))
+    fieldnames = [name.strip().lower() for name in (reader.fieldnames or [])]
+    if 'username' not in fieldnames:
+        raise ValueError("CSV faylda 'username' ustuni bo'lishi shart")
+    reader.fieldnames = fieldnames
+    pdf_column = next((name for name in ('pdf', 'filename', 'file') if name in fieldnames), None)
+
+    members = {}
+    if archive is not None:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith('.pdf'):
+                members.setdefault(os.path.basename(info.filename), info)
+
+    rows = []
+    seen = set()
+    for row_number, row in enumerate(reader, start=2):
+        username = normalize_username(row.get('username'))
+        pdf_name = os.path.basename((row.get(pdf_column) or '').strip()) if pdf_column else ''
+        result = {'row': row_number, 'username': username, 'pdf': pdf_name or None}
+        if not username:
+            result.update(status='error', message='username bo\'sh')
+        elif username in RESERVED_USERNAMES:
+            result.update(status='error', message='username band (tizim yo\'li)')
+        elif username in seen:
+            result.update(status='error', message='username CSV da takrorlangan')
+        elif pdf_name and pdf_name not in members:
+            result.update(status='error', message='PDF arxivda topilmadi')
+        else:
+            result['status'] = 'ok'
+            seen.add(username)
+        rows.append(result)
+
+    valid_rows = [row for row in rows if row['status'] == 'ok']
+    existing = {}
+    usernames = [row['username'] for row in valid_rows]
+    for offset in range(0, len(usernames), 500):
+        batch = usernames[offset:offset + 500]
+        for doc_id, username, filename in db.session.query(
+            Document.id, Document.username, Document.filename
+        ).filter(Document.username.in_(batch)):
+            existing[username] = (doc_id, filename)
+
+    new_blobs = {}
+    stored_blobs = {}
+    inserts = []
+    updates = []
+    released = []
+    for row in valid_rows:
+        username = row['username']
+        if username in existing and not row['pdf']:
+            row.update(status='error', message='username allaqachon mavjud')
+            continue
+
+        values = {'filename': None, 'original_filename': None, 'content_hash': None, 'status': 'ready'}
+        if row['pdf']:
+            try:
+                temp_path, content_hash = _spool_archive_member(archive, members[row['pdf']])
+            except ARCHIVE_MEMBER_ERRORS as exc:
+                row.update(status='error', message=str(exc))
+                continue
+
+            stored_filename = f'{content_hash}.pdf'
+            if content_hash in stored_blobs:
+                os.remove(temp_path)
+            elif pdf_storage.exists(stored_filename):
+                os.remove(temp_path)
+                # Egizak hali siqilayotgan bo'lishi mumkin - holati upload_pdf dagidek ko'chiriladi
+                twin_status = db.session.query(Document.status).filter(
+                    Document.content_hash == content_hash
+                ).limit(1).scalar()
+                stored_blobs[content_hash] = twin_status or 'ready'
+            else:
+                pdf_storage.save(temp_path, stored_filename)
+                stored_blobs[content_hash] = 'ready'
+                if pikepdf is not None:
+                    new_blobs[content_hash] = True
+                    stored_blobs[content_hash] = 'pending'
+            values.update(
+                filename=stored_filename,
+                original_filename=row['pdf'],
+                content_hash=content_hash,
+                status=stored_blobs[content_hash]
+            )
+
+        if username in existing:
+            doc_id, old_filename = existing[username]
+            updates.append(dict(values, id=doc_id))
+            if old_filename and old_filename != values['filename']:
+                released.append(old_filename)
+            row['status'] = 'updated'
+        else:
+            inserts.append(dict(values, username=username))
+            row['status'] = 'created'
+
+    if inserts:
+        db.session.execute(insert(Document), inserts)
+    if updates:
+        db.session.execute(update(Document), updates)
+    jobs = [enqueue_optimize_job(content_hash) for content_hash in new_blobs]
+    text_jobs = [enqueue_text_job(content_hash) for content_hash in stored_blobs]
+    db.session.commit()
+
+    for row in rows:
+        if row['status'] in ('created', 'updated'):
+            invalidate_document(row['username'])
+    if inserts:
+        username_filter.invalidate()
+    for filename in set(released):
+        release_pdf_file(filename)
+
+    futures = [
+        run_processing_job(job.id, pool_name='bulk-optimize', max_workers=app.config['BULK_IMPORT_WORKERS'])
+        for job in jobs
+    ]
+    futures += [run_processing_job(job.id) for job in text_jobs if job is not None]
+    for content_hash in stored_blobs:
+        enqueue_pdf_render(f'{content_hash}.pdf')
+
+    return rows, [future for future in futures if future is not None]
+
+
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(document):
+    return f"{document.created_at.isoformat()}_{document.id}"
+
+
+def _decode_cursor(cursor):
+    try:
+        created_at, _, doc_id = cursor.rpartition('_')
+        return datetime.fromisoformat(created_at), int(doc_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def list_documents(after=None, prefix=None, limit=DASHBOARD_PAGE_SIZE):
+    """
+    Hujjatlarni (created_at, id) bo'yicha kamayish tartibida keyset paginatsiya bilan olish.
+
+    `after` - oldingi sahifaning oxirgi yozuvi kursori; `prefix` - username boshi.
+    Natija: (hujjatlar, keyingi sahifa kursori yoki None).
+    """
+    query = Document.query.order_by(Document.created_at.desc(), Document.id.desc())
 
-app = Flask(
-    __name__,
-    instance_relative_config=True,
-    static_url_path='/static',
-    static_folder='static'
-)
-app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
+    prefix = normalize_username(prefix)
+    if prefix:
+        # Indeksdan foydalanadigan oraliq: LIKE 'prefix%' ga teng
+        query = query.filter(Document.username >= prefix, Document.username < prefix + '\uffff')
 
-data_directory = os.environ.get('DATA_DIR')
-if data_directory:
-    data_directory = os.path.abspath(data_directory)
-else:
-    data_directory = app.instance_path
+    position = _decode_cursor(after) if after else None
+    if position is not None:
+        query = query.filter(tuple_(Document.created_at, Document.id) < position)
 
-os.makedirs(data_directory, exist_ok=True)
+    documents = query.limit(limit + 1).all()
+    next_cursor = _encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return documents[:limit], next_cursor
 
-default_db_path = os.path.join(data_directory, 'database.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{default_db_path}')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = os.path.join(data_directory, 'uploads')
-app.config['STATIC_PDF_FOLDER'] = os.path.join(app.static_folder, 'docs')
-app.config['STATIC_PDF_IMAGE_FOLDER'] = os.path.join(app.static_folder, 'docs_images')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-db = SQLAlchemy(app)
+SEARCH_RESULT_LIMIT = 50
+SEARCH_SNIPPET_CHARS = 160
+_fts_available = None
 
-# Upload papkasini yaratish
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['STATIC_PDF_FOLDER'], exist_ok=True)
-os.makedirs(app.config['STATIC_PDF_IMAGE_FOLDER'], exist_ok=True)
 
-# Database modellari
-class Admin(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
+def text_search_uses_fts():
+    """FTS5 indeksi mavjudmi (migratsiya uni faqat SQLite da yaratadi); natija jarayon uchun eslab qolinadi"""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = 'document_text_fts' in inspect(db.engine).get_table_names()
+    return _fts_available
 
-class Document(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False, index=True)
-    filename = db.Column(db.String(255), nullable=True)  # PDF yuklanmasdan ham username yaratish mumkin
-    original_filename = db.Column(db.String(255), nullable=True)
-    created_at = db.Column(db.DateTime, default=db.func.now())
-    
-    def has_pdf(self):
-        """PDF yuklanganligini tekshirish"""
-        return self.filename is not None and self.filename != ''
 
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'admin_logged_in' not in session:
-            return redirect(url_for('admin_login'))
-        return f(*args, **kwargs)
-    return decorated_function
+def _search_terms(query_text):
+    return [term for term in query_text.split() if term][:10]
 
-def init_db():
-    """Database jadvallarini yaratish va admin yaratish"""
-    with app.app_context():
-        inspector = inspect(db.engine)
-        needs_migration = False
-
-        if 'document' in inspector.get_table_names():
-            columns = {col['name']: col for col in inspector.get_columns('document')}
-            filename_col = columns.get('filename')
-            original_col = columns.get('original_filename')
-            if (filename_col and not filename_col.get('nullable', True)) or (
-                original_col and not original_col.get('nullable', True)
-            ):
-                needs_migration = True
-
-        if needs_migration:
-            with db.engine.begin() as connection:
-                connection.execute(text("ALTER TABLE document RENAME TO document_old"))
-                connection.execute(text(
-                    """
-                    CREATE TABLE document (
-                        id INTEGER NOT NULL PRIMARY KEY,
-                        username VARCHAR(100) NOT NULL UNIQUE,
-                        filename VARCHAR(255),
-                        original_filename VARCHAR(255),
-                        created_at DATETIME DEFAULT (CURRENT_TIMESTAMP)
-                    )
-                    """
-                ))
-                connection.execute(text(
-                    """
-                    INSERT INTO document (id, username, filename, original_filename, created_at)
-                    SELECT id, username, filename, original_filename, created_at FROM document_old
-                    """
-                ))
-                connection.execute(text("DROP TABLE document_old"))
-            print("Document jadvali migratsiya qilindi (filename nullable).")
 
-        db.create_all()
+def _fts_match_expression(terms):
+    # Har bir so'z alohida ibora sifatida (FTS sintaksisi foydalanuvchidan kelmaydi) va prefiks bo'yicha
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
 
-    # Eski fayllarni static papkaga ko'chirish
-        for document in Document.query.filter(Document.filename != None).all():  # noqa: E711
-            old_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
-            new_path = os.path.join(app.config['STATIC_PDF_FOLDER'], document.filename)
-            if os.path.exists(old_path) and not os.path.exists(new_path):
-                os.makedirs(os.path.dirname(new_path), exist_ok=True)
-                shutil.move(old_path, new_path)
-        
-        # Admin yaratish/yangilash (.env dan o'qiladi)
-        admin_username = os.environ.get('ADMIN_USERNAME', 'admin')
-        admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
-        
-        existing_admin = Admin.query.filter_by(username=admin_username).first()
-        
-        if existing_admin:
-            # Admin mavjud - parolni yangilash (.env dagi parol bilan)
-            existing_admin.password_hash = generate_password_hash(admin_password)
-            db.session.commit()
-            print(f"Admin parol yangilandi: username='{admin_username}'")
-        else:
-            # Yangi admin yaratish
-            admin = Admin(
-                username=admin_username,
-                password_hash=generate_password_hash(admin_password)
-            )
-            db.session.add(admin)
-            db.session.commit()
-            print(f"Yangi admin yaratildi: username='{admin_username}'")
 
-def generate_qr_code(url):
-    """QR kod yaratish"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
+def _like_snippet(body, terms):
+    lowered = body.lower()
+    position = min((lowered.find(term.lower()) for term in terms if term.lower() in lowered), default=0)
+    start = max(position - SEARCH_SNIPPET_CHARS // 3, 0)
+    snippet = body[start:start + SEARCH_SNIPPET_CHARS]
+    return ('…' if start else '') + snippet + ('…' if start + SEARCH_SNIPPET_CHARS < len(body) else '')
+
 
+def _search_text_index(terms, limit):
+    """Mos keladigan fayllar: [(content_hash, parcha)], eng moslari birinchi"""
+    if text_search_uses_fts():
+        rows = db.session.execute(text(
+            "SELECT document_text.content_hash, "
+            "snippet(document_text_fts, 0, '', '', '…', 24) "
+            "FROM document_text_fts JOIN document_text ON document_text.id = document_text_fts.rowid "
+            "WHERE document_text_fts MATCH :match "
+            "ORDER BY bm25(document_text_fts) LIMIT :limit"
+        ), {'match': _fts_match_expression(terms), 'limit': limit})
+        return [(content_hash, snippet) for content_hash, snippet in rows]
 
-def get_pdf_image_urls(filename: str):
+    # FTS siz bazalar (MySQL, PostgreSQL): har bir so'z matnda uchrashi kerak
+    query = db.session.query(DocumentText.content_hash, DocumentText.body)
+    for term in terms:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(DocumentText.body.ilike(f'%{escaped}%', escape='\\'))
+    rows = query.order_by(DocumentText.updated_at.desc()).limit(limit).all()
+    return [(content_hash, _like_snippet(body, terms)) for content_hash, body in rows]
+
+
+def search_documents(query_text, limit=SEARCH_RESULT_LIMIT):
     """
-    PDF sahifalarini PNG rasmlarga aylantiradi va URL ro'yxatini qaytaradi.
+    Sertifikat matni bo'yicha qidirish: [(hujjat, matn parchasi)].
+
+    SQLite da FTS5 indeksi (bm25 bo'yicha tartib, so'z boshi bo'yicha moslik),
+    boshqa bazalarda LIKE ishlatiladi. Bitta fayl bir nechta username ga
+    tegishli bo'lsa, ularning barchasi qaytariladi.
     """
-    if fitz is None:
+    terms = _search_terms(query_text or '')
+    if not terms:
         return []
 
-    pdf_path = os.path.join(app.config['STATIC_PDF_FOLDER'], filename)
-    if not os.path.exists(pdf_path):
-        return []
+    with timed_stage('search'):
+        try:
+            matches = _search_text_index(terms, limit)
+        except OperationalError:
+            db.session.rollback()
+            return []
+        if not matches:
+            return []
+        rank = {content_hash: index for index, (content_hash, _) in enumerate(matches)}
+        snippets = dict(matches)
+        documents = Document.query.filter(Document.content_hash.in_(list(rank))).all()
 
-    base_name = os.path.splitext(filename)[0]
-    image_dir = os.path.join(app.config['STATIC_PDF_IMAGE_FOLDER'], base_name)
-    os.makedirs(image_dir, exist_ok=True)
+    documents.sort(key=lambda document: (rank[document.content_hash], document.username))
+    return [(document, snippets[document.content_hash]) for document in documents[:limit]]
 
-    image_urls = []
 
-    existing_images = sorted(
-        [
-            f for f in os.listdir(image_dir)
-            if f.lower().endswith('.png')
-        ]
-    )
+def _compress_page(body):
+    """HTML ni oldindan siqish: {'identity': ..., 'gzip': ..., 'br': ...} (kichrayganlari)"""
+    bodies = {'identity': body}
+    gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(gzip_body) < len(body):
+        bodies['gzip'] = gzip_body
+    if brotli is not None:
+        br_body = brotli.compress(body, quality=11, mode=brotli.MODE_TEXT)
+        if len(br_body) < len(body):
+            bodies['br'] = br_body
+    return bodies
 
-    if not existing_images:
-        try:
-            doc = fitz.open(pdf_path)
-        except Exception:
-            return []
 
-        for page_index, page in enumerate(doc, start=1):
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), alpha=False)
-            image_filename = f'page_{page_index}.png'
-            image_path = os.path.join(image_dir, image_filename)
-            pix.save(image_path)
-            image_urls.append(
-                url_for(
-                    'static',
-                    filename=f'docs_images/{base_name}/{image_filename}'
-                )
-            )
+def render_cached_page(cache_key, version, template_name, vary_user_agent=False, context_factory=None, **context):
+    """
+    Sahifani keshdan (yoki render qilib) ETag bilan qaytarish.
+
+    Brauzer/CDN nusxani saqlaydi, lekin har safar ETag bilan tekshiradi (no-cache):
+    hujjat o'zgarmagan bo'lsa 304, o'zgargan bo'lsa yangi sahifa qaytadi.
+    `context_factory` - faqat keshda topilmaganda chaqiriladigan qimmat kontekst;
+    u None qaytarsa sahifa render qilinmaydi va None qaytadi.
+    """
+    entry = page_cache.get(cache_key)
+    cache_hit = entry is not None and entry.version == version
+    record_cache_lookup('page', cache_hit)
+    if not cache_hit:
+        if context_factory is not None:
+            extra_context = context_factory()
+            if extra_context is None:
+                return None
+            context.update(extra_context)
+        with timed_stage('template'):
+            body = render_template(template_name, **context).encode('utf-8')
+        entry = CachedPage(version, hashlib.sha1(body).hexdigest(), _compress_page(body))
+        page_cache.set(cache_key, entry)
+
+    if request.if_none_match.contains_weak(entry.etag):
+        response = Response(status=304)
     else:
-        for image_filename in existing_images:
-            image_urls.append(
-                url_for(
-                    'static',
-                    filename=f'docs_images/{base_name}/{image_filename}'
-                )
-            )
+        # Mijoz qabul qiladigan eng kichik variant (br < gzip < identity)
+        accepted = request.accept_encodings
+        encoding = min(
+            (name for name in entry.bodies if name == 'identity' or accepted[name]),
+            key=lambda name: len(entry.bodies[name]),
+        )
+        response = Response(entry.bodies[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(entry.etag, weak=True)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    response.vary.add('Accept-Encoding')
+    if vary_user_agent:
+        response.vary.add('User-Agent')
+    return response
 
-    return image_urls
+_jobs_resumed = False
 
 
-def render_no_cache(template_name, **context):
-    response = make_response(render_template(template_name, **context))
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+@app.before_request
+def resume_jobs_once():
+    # Har bir worker birinchi so'rovda tugallanmay qolgan fon vazifalarini tiklaydi
+    global _jobs_resumed
+    if _jobs_resumed:
+        return
+    _jobs_resumed = True
+    start_gc_thread()
+    try:
+        resume_processing_jobs()
+    except Exception:
+        db.session.rollback()
+
+_not_found_body = None
 
-# Database initialization - gunicorn uchun
-init_db()
 
 # 404 Error handler
 @app.errorhandler(404)
 def not_found(error):
-    return render_template('404.html'), 404
+    # Sahifa statik - skanerlar so'rovlari uchun har safar qayta render qilinmaydi
+    global _not_found_body
+    if _not_found_body is None:
+        _not_found_body = render_template('404.html')
+    return _not_found_body, 404
 
 # Bosh sahifa
 @app.route('/')
@@ -267,137 +3085,499 @@ def favicon():
 # Foydalanuvchi sahifasi
 @app.route('/<username>')
 def user_page(username):
-    # Favicon va boshqa tizim so'rovlarini filtrlash
-    if username in ['favicon.ico', 'robots.txt', 'sitemap.xml']:
-        abort(404)
-    document = Document.query.filter_by(username=username).first_or_404()
+    document = find_public_document(username)
     
+    user_agent = (request.user_agent.string or '').lower()
+    is_android = 'android' in user_agent
+    cache_key = f"user:{username}:{'android' if is_android else 'desktop'}"
+
     # PDF yuklanmagan bo'lsa
-    if not document.has_pdf():
-        return render_no_cache('user_page_no_pdf.html', username=username)
+    if not document.has_pdf:
+        return render_cached_page(
+            cache_key, '', 'user_page_no_pdf.html', vary_user_agent=True, username=username
+        )
 
     viewer_url = url_for('pdf_viewer', username=document.username)
     download_url = url_for('serve_pdf', filename=document.filename)
 
-    user_agent = (request.user_agent.string or '').lower()
-    is_android = 'android' in user_agent
-
     if is_android and fitz is not None:
-        image_urls = get_pdf_image_urls(document.filename)
-        if image_urls:
-            return render_no_cache(
-                'user_page_images.html',
-                image_urls=image_urls,
-                download_url=download_url,
-                username=username
-            )
+        # Sahifa rasmlari ro'yxati (metadata o'qish, render navbati) faqat kesh topilmaganda tuziladi
+        def page_images_context():
+            with timed_stage('pages'):
+                pages = get_pdf_page_images(document.filename)
+            return {'pages': pages} if pages else None
+
+        response = render_cached_page(
+            cache_key,
+            document.filename,
+            'user_page_images.html',
+            vary_user_agent=True,
+            context_factory=page_images_context,
+            download_url=download_url,
+            username=username
+        )
+        if response is not None:
+            return response
 
     if is_android:
         return redirect(download_url)
 
-    return render_no_cache('user_page.html', viewer_url=viewer_url, download_url=download_url, username=username)
+    return render_cached_page(
+        cache_key,
+        document.filename,
+        'user_page.html',
+        vary_user_agent=True,
+        viewer_url=viewer_url,
+        download_url=download_url,
+        username=username
+    )
 
-@app.route('/pdf/<filename>')
-def serve_pdf(filename):
-    """PDF faylni optimallashtirilgan holda uzatish"""
-    file_path = os.path.join(app.config['STATIC_PDF_FOLDER'], filename)
-    if not os.path.exists(file_path) or not os.path.isfile(file_path):
+@app.route('/dzi/<doc>/<tag>/<int:page>.dzi')
+def pdf_page_dzi(doc, tag, page):
+    """Sahifaning Deep Zoom (DZI) tavsifi - OpenSeadragon plitkalarni shundan hisoblaydi"""
+    if doc != secure_filename(doc) or tag != dzi_tag():
+        abort(404)
+    metadata = get_pdf_metadata(f'{doc}.pdf')
+    if metadata is None or not 1 <= page <= metadata['pages']:
+        abort(404)
+
+    full_width, full_height, _ = _dzi_geometry(metadata, page)
+    descriptor = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{app.config["DZI_TILE_FORMAT"]}" Overlap="{app.config["DZI_OVERLAP"]}" '
+        f'TileSize="{app.config["DZI_TILE_SIZE"]}">'
+        f'<Size Width="{full_width}" Height="{full_height}"/></Image>'
+    )
+    response = Response(descriptor, mimetype='application/xml')
+    response.cache_control.public = True
+    response.cache_control.max_age = PAGE_IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/dzi/<doc>/<tag>/<int:page>_files/<int:level>/<int:column>_<int:row>.<fmt>')
+def pdf_page_tile(doc, tag, page, level, column, row, fmt):
+    """Bitta DZI plitkasi (birinchi so'rovda faqat shu soha render qilinadi)"""
+    if fmt != app.config['DZI_TILE_FORMAT'] or fmt not in PAGE_IMAGE_FORMATS:
+        abort(404)
+    if doc != secure_filename(doc) or tag != dzi_tag():
+        abort(404)
+    filename = f'{doc}.pdf'
+    metadata = get_pdf_metadata(filename)
+    if metadata is None or not 1 <= page <= metadata['pages']:
+        abort(404)
+
+    full_width, full_height, max_level = _dzi_geometry(metadata, page)
+    if level > max_level:
+        abort(404)
+    level_size = _dzi_level_size(full_width, full_height, max_level, level)
+    box = _dzi_tile_box(*level_size, column, row)
+    if box is None:
+        abort(404)
+
+    _, pdf_path, image_dir = _render_paths(filename)
+    tile_path = _dzi_tile_path(image_dir, page, level, column, row, fmt)
+    if not os.path.exists(tile_path):
+        try:
+            with timed_stage('tile'):
+                _render_dzi_tile(pdf_path, page, level_size, box, fmt, tile_path)
+        except Exception:
+            abort(404)
+
+    response = send_file(
+        tile_path,
+        mimetype=PAGE_IMAGE_FORMATS[fmt][1],
+        max_age=PAGE_IMAGE_MAX_AGE,
+        conditional=True
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/zoom/<doc>/<int:page>')
+def pdf_page_zoom(doc, page):
+    """Sahifani kattalashtirib ko'rish (muhr va imzoni tekshirish uchun)"""
+    if fitz is None or doc != secure_filename(doc):
+        abort(404)
+    metadata = get_pdf_metadata(f'{doc}.pdf')
+    if metadata is None or not 1 <= page <= metadata['pages']:
         abort(404)
 
+    response = make_response(render_template(
+        'page_zoom.html',
+        dzi_url=url_for('pdf_page_dzi', doc=doc, tag=dzi_tag(), page=page),
+        page=page,
+        pages=metadata['pages'],
+    ))
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+PDF_OFFLOAD_MODES = ('x-accel', 'x-sendfile')
+# Bitta so'rovdagi Range oraliqlari chegarasi (ko'p mayda oraliqlar bilan hujumdan himoya)
+MAX_BYTE_RANGES = 32
+
+
+def parse_byte_ranges(range_header, file_size):
+    """
+    `Range: bytes=...` sarlavhasini RFC 7233 bo'yicha tahlil qiladi.
+
+    Natija:
+    - None - sarlavha noto'g'ri yoki qo'llab-quvvatlanmaydi, butun fayl (200) qaytariladi;
+    - [] - oraliqlarning hech biri faylga to'g'ri kelmaydi (416);
+    - [(start, end), ...] - tartiblangan, ustma-ust tushganlari birlashtirilgan oraliqlar.
+    """
+    units, _, range_set = range_header.partition('=')
+    if units.strip().lower() != 'bytes' or not range_set.strip():
+        return None
+
+    ranges = []
+    for spec in range_set.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        start_str, dash, end_str = spec.partition('-')
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not dash or not (start_str.isdigit() or start_str == '') or not (end_str.isdigit() or end_str == ''):
+            return None
+
+        if start_str == '':
+            # Suffiks oraliq: bytes=-500 - oxirgi 500 bayt
+            if end_str == '':
+                return None
+            suffix_length = int(end_str)
+            if suffix_length == 0:
+                continue
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+            if end_str and end < start:
+                return None
+            if start >= file_size:
+                continue
+            end = min(end, file_size - 1)
+
+        if file_size > 0:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_BYTE_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(if_range, etag, last_modified):
+    """If-Range validatori joriy faylga mos kelsa True (aks holda butun fayl beriladi)"""
+    if_range = if_range.strip()
+    if if_range.startswith('W/'):
+        return False
+    if if_range.strip('"') == etag:
+        return True
+    try:
+        validator_date = parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+    if validator_date.tzinfo is None:
+        validator_date = validator_date.replace(tzinfo=timezone.utc)
+    return validator_date == last_modified
+
+
+def multipart_byteranges_parts(byte_ranges, file_size, boundary):
+    """`multipart/byteranges` qismlarining sarlavhalari, yopuvchi chegara va tananing aniq uzunligi."""
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: application/pdf\r\n'
+            f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+        ).encode('ascii')
+        for start, end in byte_ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    content_length = len(closing) + sum(
+        len(header) + (end - start + 1) for header, (start, end) in zip(part_headers, byte_ranges)
+    ) + 2 * (len(byte_ranges) - 1)
+    return part_headers, closing, content_length
+
+
+def _multipart_byteranges_body(file_path, byte_ranges, file_size, boundary):
+    """`multipart/byteranges` javob tanasi generatori va uning aniq uzunligini qaytaradi."""
+    chunk_size = app.config['PDF_STREAM_CHUNK_SIZE']
+    part_headers, closing, content_length = multipart_byteranges_parts(byte_ranges, file_size, boundary)
+
+    def generate():
+        for index, (header, (start, end)) in enumerate(zip(part_headers, byte_ranges)):
+            if index:
+                yield b'\r\n'
+            yield header
+            yield from _iter_file_range(file_path, start, end - start + 1, chunk_size)
+        yield closing
+
+    return generate(), content_length
+
+
+def _iter_file_range(file_path, start, length, chunk_size):
+    with open(file_path, 'rb') as pdf_file:
+        pdf_file.seek(start)
+        bytes_remaining = length
+        while bytes_remaining > 0:
+            data = pdf_file.read(min(chunk_size, bytes_remaining))
+            if not data:
+                break
+            yield data
+            bytes_remaining -= len(data)
+
+
+def _pdf_response_body(file_path, start, length, file_size, serve_mode):
+    """
+    Fayl qismini uzatish uchun WSGI javob tanasini tayyorlaydi.
+
+    `sendfile` rejimida fayl `wsgi.file_wrapper` ga beriladi - gunicorn uni
+    `os.sendfile` orqali yadroning o'zida uzatadi. Qisman (Range) javobda
+    wrapper faqat Content-Length ni hurmat qiladigan serverda (gunicorn)
+    ishlatiladi, aks holda Python generatoriga qaytiladi.
+    """
+    chunk_size = app.config['PDF_STREAM_CHUNK_SIZE']
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if serve_mode == 'sendfile' and file_wrapper is not None:
+        full_file = start == 0 and length == file_size
+        server_software = request.environ.get('SERVER_SOFTWARE', '')
+        if full_file or server_software.startswith('gunicorn'):
+            pdf_file = open(file_path, 'rb')
+            pdf_file.seek(start)
+            return file_wrapper(pdf_file, chunk_size)
+
+    return stream_with_context(_iter_file_range(file_path, start, length, chunk_size))
+
+
+# serve_pdf javobining rejasi: WSGI (Flask) va ASGI (asgi.py) bir xil qoidalar bilan uzatadi.
+# byte_ranges - None (butun fayl), bitta yoki bir nechta (multipart) oraliq; body=False - tanasiz javob
+PdfServePlan = namedtuple(
+    'PdfServePlan', ['status', 'headers', 'file_path', 'file_size', 'byte_ranges', 'boundary', 'body']
+)
+
+
+# Optimize holati jarayon ichida qisqa muddat eslab qolinadi: PDF.js ning har bir Range so'rovi DB ga
+# bormaydi. Fayl URL i hujjat commit qilingandan keyin ma'lum bo'ladi, vazifa ham o'sha commit da
+# yoziladi - shuning uchun "tugagan" javobi vazifadan oldin keshga tushib qolmaydi
+OPTIMIZATION_STATE_TTL = 5
+_optimization_state_cache = LRUCache(4096, OPTIMIZATION_STATE_TTL)
+
+
+def _pdf_optimization_pending(filename):
+    """Fayl uchun optimize vazifasi hali tugamaganmi (ASGI oqimidan ham chaqiriladi - o'z app context i bilan)"""
+    content_hash = os.path.splitext(filename)[0]
+    if len(content_hash) != 64 or content_hash.strip('0123456789abcdef'):
+        # Kontent xeshi bo'lmagan nom (eski yuklashlar) uchun vazifa yaratilmaydi
+        return False
+
+    pending = _optimization_state_cache.get(content_hash)
+    if pending is None:
+        with app.app_context():
+            pending = db.session.query(ProcessingJob.id).filter(
+                ProcessingJob.kind == 'optimize',
+                ProcessingJob.content_hash == content_hash,
+                ProcessingJob.status.in_(('pending', 'running')),
+            ).first() is not None
+        _optimization_state_cache.set(content_hash, pending)
+    return pending
+
+
+def plan_pdf_response(filename, request_headers, force_download=False):
+    """
+    PDF so'rovi uchun status, sarlavhalar va uzatiladigan oraliqlarni hisoblaydi.
+
+    Conditional GET (ETag/Last-Modified), Range/If-Range va offload rejimlari shu yerda
+    bajariladi; baytlarni uzatish chaqiruvchiga qoladi. Fayl topilmasa None qaytaradi.
+    """
+    file_path = pdf_storage.fetch(filename)
+    if file_path is None:
+        return None
+
     file_stat = os.stat(file_path)
     last_modified = datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc).replace(microsecond=0)
     etag_base = f"{file_stat.st_ino}-{file_stat.st_size}-{file_stat.st_mtime}".encode('utf-8')
     etag = hashlib.sha1(etag_base).hexdigest()
+    file_size = file_stat.st_size
+
+    def plan(status, headers=None, byte_ranges=None, boundary=None, body=True):
+        return PdfServePlan(status, headers or {}, file_path, file_size, byte_ranges, boundary, body)
 
     # Conditional GET: ETag
-    if request.headers.get('If-None-Match') == etag:
-        return Response(status=304)
+    if request_headers.get('If-None-Match') == etag:
+        return plan(304, body=False)
 
     # Conditional GET: Last-Modified
-    if_modified_since = request.headers.get('If-Modified-Since')
+    if_modified_since = request_headers.get('If-Modified-Since')
     if if_modified_since:
         try:
             ims = parsedate_to_datetime(if_modified_since)
             if ims.tzinfo is None:
                 ims = ims.replace(tzinfo=timezone.utc)
             if ims >= last_modified:
-                return Response(status=304)
+                return plan(304, body=False)
         except (TypeError, ValueError):
             pass
 
-    force_download = request.args.get('download') == '1'
-    range_header = request.headers.get('Range')
-    status_code = 200
-    content_range = None
-    chunk_size = 8192
-    start = 0
-    end = file_stat.st_size - 1
+    serve_mode = app.config['PDF_SERVE_MODE']
+    byte_ranges = None
+
+    # Offload rejimida Range/If-Range ni front server o'zi bajaradi
+    range_header = request_headers.get('Range')
+    if range_header and serve_mode not in PDF_OFFLOAD_MODES:
+        if_range = request_headers.get('If-Range')
+        if if_range is None or _if_range_matches(if_range, etag, last_modified):
+            byte_ranges = parse_byte_ranges(range_header, file_size)
 
     if range_header:
-        # Format: bytes=start-end
-        try:
-            units, range_spec = range_header.split('=', 1)
-            if units.strip().lower() == 'bytes':
-                range_spec = range_spec.strip()
-                if ',' in range_spec:
-                    range_spec = range_spec.split(',', 1)[0]
-                start_str, end_str = range_spec.split('-', 1)
-                if start_str:
-                    start = int(start_str)
-                if end_str:
-                    end = int(end_str)
-                if start > end or end >= file_stat.st_size:
-                    start = 0
-                    end = file_stat.st_size - 1
-                status_code = 206
-                content_range = f'bytes {start}-{end}/{file_stat.st_size}'
-        except ValueError:
-            start = 0
-            end = file_stat.st_size - 1
-
-    length = end - start + 1
-
-    def generate(start_pos, end_pos):
-        with open(file_path, 'rb') as pdf_file:
-            pdf_file.seek(start_pos)
-            bytes_remaining = length
-            while bytes_remaining > 0:
-                read_size = min(chunk_size, bytes_remaining)
-                data = pdf_file.read(read_size)
-                if not data:
-                    break
-                yield data
-                bytes_remaining -= len(data)
-
-    response = Response(stream_with_context(generate(start, end)), status=status_code, mimetype='application/pdf')
-    response.headers['Content-Length'] = str(length)
+        if serve_mode in PDF_OFFLOAD_MODES:
+            range_kind = 'offloaded'
+        elif byte_ranges is None:
+            range_kind = 'ignored'
+        elif not byte_ranges:
+            range_kind = 'unsatisfiable'
+        else:
+            range_kind = 'multi' if len(byte_ranges) > 1 else 'single'
+        metrics.inc('shahodatnoma_pdf_range_requests_total', kind=range_kind)
+
+    if byte_ranges == []:
+        return plan(416, {
+            'Content-Range': f'bytes */{file_size}',
+            'Accept-Ranges': 'bytes',
+        }, body=False)
+
+    headers = {}
+    boundary = None
+    if serve_mode in PDF_OFFLOAD_MODES:
+        # Baytlarni front server (nginx/Apache) o'zi uzatadi, Range ni ham o'zi bajaradi
+        status = 200
+        headers['Content-Type'] = 'application/pdf'
+        if serve_mode == 'x-accel':
+            accel_prefix = app.config['PDF_ACCEL_PREFIX'].rstrip('/')
+            headers['X-Accel-Redirect'] = f'{accel_prefix}/{quote(filename)}'
+        else:
+            headers['X-Sendfile'] = file_path
+    elif byte_ranges and len(byte_ranges) > 1:
+        status = 206
+        boundary = os.urandom(12).hex()
+        _, _, content_length = multipart_byteranges_parts(byte_ranges, file_size, boundary)
+        headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+        headers['Content-Length'] = str(content_length)
+    else:
+        status = 206 if byte_ranges else 200
+        start, end = byte_ranges[0] if byte_ranges else (0, file_size - 1)
+        headers['Content-Type'] = 'application/pdf'
+        headers['Content-Length'] = str(end - start + 1)
+        if byte_ranges:
+            headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+
     disposition_type = 'attachment' if force_download else 'inline'
-    response.headers['Content-Disposition'] = f'{disposition_type}; filename="{filename}"'
-    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
-    response.headers['ETag'] = etag
-    response.headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
-    response.headers['Accept-Ranges'] = 'bytes'
-    if content_range:
-        response.headers['Content-Range'] = content_range
+    headers['Content-Disposition'] = f'{disposition_type}; filename="{filename}"'
+    if _pdf_optimization_pending(filename):
+        # Fayl tez orada joyida siqilgan nusxa bilan almashtiriladi - keshlar ETag bo'yicha qayta tekshirsin
+        headers['Cache-Control'] = 'public, no-cache'
+    else:
+        headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    headers['ETag'] = etag
+    headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    headers['Accept-Ranges'] = 'bytes'
+
+    metrics.inc(
+        'shahodatnoma_pdf_bytes_served_total',
+        int(headers.get('Content-Length', file_size)),
+        mode=serve_mode
+    )
+    return plan(status, headers, byte_ranges, boundary, body=serve_mode not in PDF_OFFLOAD_MODES)
+
+
+@app.route('/pdf/<filename>')
+def serve_pdf(filename):
+    """PDF faylni optimallashtirilgan holda uzatish"""
+    plan = plan_pdf_response(filename, request.headers, request.args.get('download') == '1')
+    if plan is None:
+        abort(404)
+
+    if not plan.body:
+        response = Response(status=plan.status)
+    elif plan.boundary:
+        body, _ = _multipart_byteranges_body(plan.file_path, plan.byte_ranges, plan.file_size, plan.boundary)
+        response = Response(body, status=plan.status, direct_passthrough=True)
+    else:
+        start, end = plan.byte_ranges[0] if plan.byte_ranges else (0, plan.file_size - 1)
+        response = Response(
+            _pdf_response_body(
+                plan.file_path, start, end - start + 1, plan.file_size, app.config['PDF_SERVE_MODE']
+            ),
+            status=plan.status,
+            direct_passthrough=True
+        )
+    response.headers.update(plan.headers)
+    return response
+
+@app.route('/img/<doc>/<int:page>.<fmt>', defaults={'variant': PAGE_IMAGE_DEFAULT_VARIANT})
+@app.route('/img/<doc>/<int:page>/<variant>.<fmt>')
+def pdf_page_image(doc, page, variant, fmt):
+    """PDF sahifasi rasmini qaytarish (birinchi so'rovda render qilinadi)"""
+    if fmt not in PAGE_IMAGE_FORMATS or variant not in PAGE_IMAGE_VARIANTS or doc != secure_filename(doc):
+        abort(404)
+
+    filename = f'{doc}.pdf'
+    metadata = get_pdf_metadata(filename)
+    if metadata is None or not 1 <= page <= metadata['pages']:
+        abort(404)
+
+    image_path = render_page_on_demand(filename, page, variant, fmt)
+    if image_path is None:
+        abort(404)
 
+    response = send_file(
+        image_path,
+        mimetype=PAGE_IMAGE_FORMATS[fmt][1],
+        max_age=PAGE_IMAGE_MAX_AGE,
+        conditional=True
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
     return response
 
 # PDF viewer sahifasi
 @app.route('/viewer/<username>')
 def pdf_viewer(username):
-    if username in ['favicon.ico', 'robots.txt', 'sitemap.xml']:
-        abort(404)
-    document = Document.query.filter_by(username=username).first_or_404()
-    if not document.has_pdf():
+    document = find_public_document(username)
+    if not document.has_pdf:
         abort(404)
     pdf_url = url_for('serve_pdf', filename=document.filename)
     download_url = pdf_url
-    return render_no_cache('pdf_viewer.html', pdf_url=pdf_url, download_url=download_url, username=username)
+    return render_cached_page(
+        f'viewer:{username}:all',
+        document.filename,
+        'pdf_viewer.html',
+        pdf_url=pdf_url,
+        download_url=download_url,
+        username=username
+    )
 
 # Admin login
 @app.route('/admin', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
+        # Parol tanlash (brute force) dan himoya: IP bo'yicha urinishlar soni cheklangan
+        address = client_address()
+        if not login_limiter.consume(address):
+            metrics.inc('shahodatnoma_rejected_requests_total', reason='login_limit')
+            flash("Urinishlar juda ko'p! Birozdan keyin qayta urinib ko'ring.", 'error')
+            response = make_response(render_template('admin_login.html'), 429)
+            response.headers['Retry-After'] = str(login_limiter.retry_after(address))
+            return response
+
         username = request.form.get('username')
         password = request.form.get('password')
         
@@ -424,9 +3604,76 @@ def admin_logout():
 @app.route('/admin/dashboard')
 @login_required
 def admin_dashboard():
-    documents = Document.query.order_by(Document.created_at.desc()).all()
+    search = request.args.get('q', '').strip()
+    text_search = request.args.get('text', '').strip()
+    after = request.args.get('after')
+    snippets = {}
+    if text_search:
+        # Matn bo'yicha qidiruv natijalari moslik tartibida, sahifalarsiz
+        results = search_documents(text_search)
+        documents = [document for document, _ in results]
+        snippets = {document.id: snippet for document, snippet in results}
+        next_cursor = None
+    else:
+        documents, next_cursor = list_documents(after=after, prefix=search)
     base_url = request.host_url.rstrip('/')
-    return render_template('admin_dashboard.html', documents=documents, base_url=base_url)
+    return render_template(
+        'admin_dashboard.html',
+        documents=documents,
+        base_url=base_url,
+        search=search,
+        text_search=text_search,
+        snippets=snippets,
+        next_cursor=next_cursor,
+        is_first_page=not after
+    )
+
+# Hujjatlar ro'yxati (JSON, keyset paginatsiya)
+@app.route('/admin/api/documents')
+@login_required
+def api_documents():
+    limit = request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), DASHBOARD_MAX_PAGE_SIZE)
+    documents, next_cursor = list_documents(
+        after=request.args.get('after'),
+        prefix=request.args.get('q'),
+        limit=limit
+    )
+    return jsonify({
+        'items': [
+            {
+                'id': document.id,
+                'username': document.username,
+                'has_pdf': document.has_pdf(),
+                'status': document.status,
+                'original_filename': document.original_filename,
+                'created_at': document.created_at.isoformat() if document.created_at else None,
+            }
+            for document in documents
+        ],
+        'next': next_cursor,
+    })
+
+# Sertifikat matni bo'yicha qidiruv (JSON)
+@app.route('/admin/api/search')
+@login_required
+def api_search():
+    limit = request.args.get('limit', SEARCH_RESULT_LIMIT, type=int)
+    limit = min(max(limit, 1), DASHBOARD_MAX_PAGE_SIZE)
+    results = search_documents(request.args.get('q', ''), limit=limit)
+    return jsonify({
+        'items': [
+            {
+                'id': document.id,
+                'username': document.username,
+                'original_filename': document.original_filename,
+                'url': url_for('user_page', username=document.username, _external=True),
+                'snippet': snippet,
+            }
+            for document, snippet in results
+        ],
+        'engine': 'fts5' if text_search_uses_fts() else 'like',
+    })
 
 # Username yaratish (PDFsiz)
 @app.route('/admin/create-username', methods=['POST'])
@@ -440,6 +3687,10 @@ def create_username():
     
     # Username formatini tozalash
     username = secure_filename(username).lower().replace(' ', '')
+
+    if username in RESERVED_USERNAMES:
+        flash(f'Username "{username}" tizim yo\'li bilan band, boshqasini tanlang!', 'error')
+        return redirect(url_for('admin_dashboard'))
     
     # Username mavjudligini tekshirish
     existing_doc = Document.query.filter_by(username=username).first()
@@ -455,10 +3706,40 @@ def create_username():
     )
     db.session.add(new_doc)
     db.session.commit()
+    invalidate_document(username)
+    username_filter.invalidate()
     
     flash(f'Username "{username}" muvaffaqiyatli yaratildi! Endi QR kod yuklab olishingiz mumkin.', 'success')
     return redirect(url_for('admin_dashboard'))
 
+# Ommaviy import: CSV (username[,pdf]) + PDF lar ZIP arxivi
+@app.route('/admin/bulk-import', methods=['POST'])
+@login_required
+def bulk_import():
+    csv_file = request.files.get('csv_file')
+    zip_file = request.files.get('zip_file')
+    if csv_file is None or csv_file.filename == '':
+        flash('CSV fayl majburiy!', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    try:
+        csv_text = csv_file.stream.read().decode('utf-8-sig')
+        archive = None
+        if zip_file is not None and zip_file.filename:
+            archive = zipfile.ZipFile(zip_file.stream)
+        rows, _ = import_certificates(csv_text, archive)
+    except (UnicodeDecodeError,) + ARCHIVE_MEMBER_ERRORS as exc:
+        flash(f'Import xatosi: {exc}', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    summary = {
+        status: sum(1 for row in rows if row['status'] == status)
+        for status in ('created', 'updated', 'error')
+    }
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'summary': summary, 'rows': rows})
+    return render_template('bulk_import_report.html', rows=rows, summary=summary)
+
 # PDF yuklash (mavjud username ga)
 @app.route('/admin/upload', methods=['POST'])
 @login_required
@@ -487,50 +3768,58 @@ def upload_pdf():
         flash(f'Username "{username}" topilmadi! Avval username yarating.', 'error')
         return redirect(url_for('admin_dashboard'))
 
-    # Vaqtinchalik faylga saqlash
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', dir=app.config['UPLOAD_FOLDER']) as tmp:
-        file.save(tmp.name)
-        temp_input = tmp.name
-
-    # PDF ni siqish va optimallashtirish
-    optimized_filename = f"{username}_{os.urandom(8).hex()}.pdf"
-    optimized_path = os.path.join(app.config['STATIC_PDF_FOLDER'], optimized_filename)
-
-    compression_succeeded = False
-    if pikepdf is not None:
-        try:
-            with pikepdf.open(temp_input) as pdf:
-                save_kwargs = {'linearize': True}
-                compression_level = getattr(pikepdf, 'CompressionLevel', None)
-                if compression_level:
-                    save_kwargs['compression'] = compression_level.default
-                try:
-                    pdf.save(optimized_path, optimize_streams=True, **save_kwargs)
-                except TypeError:
-                    pdf.save(optimized_path, **save_kwargs)
-                compression_succeeded = True
-        except Exception as exc:  # noqa: F841
-            compression_succeeded = False
-
-    if not compression_succeeded:
-        shutil.copyfile(temp_input, optimized_path)
-
-    # Vaqtinchalik faylni o'chirish
-    try:
-        os.remove(temp_input)
-    except OSError:
-        pass
-
-    # Oldingi PDF faylni o'chirish (agar mavjud bo'lsa)
-    if existing_doc.filename:
-        old_static_path = os.path.join(app.config['STATIC_PDF_FOLDER'], existing_doc.filename)
-        if os.path.exists(old_static_path):
-            os.remove(old_static_path)
-
-    # Database'ni yangilash
-    existing_doc.filename = optimized_filename
-    existing_doc.original_filename = file.filename
-    db.session.commit()
+    # Fayl so'rov o'qilayotganda vaqtinchalik faylga yozilib, xeshlangan
+    temp_input, content_hash = _spool_upload(file)
+
+    # Kontent bo'yicha saqlash: bir xil fayl qayta yuklansa optimizatsiya o'tkazib yuboriladi
+    stored_filename = f'{content_hash}.pdf'
+    optimize_job = None
+    # Mavjud faylni tekshirishdan havola commit bo'lguncha qulf ushlanadi: parallel delete_pdf yoki GC
+    # umumiy faylni shu orada o'chirib, yangi hujjatni yo'q faylga bog'lab qo'ya olmaydi
+    with pdf_blob_lock(stored_filename):
+        deduplicated = pdf_storage.exists(stored_filename)
+        if deduplicated:
+            twin = Document.query.filter(
+                Document.content_hash == content_hash, Document.id != existing_doc.id
+            ).first()
+            status = twin.status if twin is not None and twin.status else 'ready'
+        else:
+            # Asl fayl darhol beriladi, siqish esa fon rejimida bajariladi
+            pdf_storage.save(temp_input, stored_filename)
+            status = 'pending' if pikepdf is not None else 'ready'
+
+        # Oldingi PDF faylni o'chirish (boshqa username lar ishlatmayotgan bo'lsa)
+        old_filename = existing_doc.filename
+
+        # Database'ni yangilash
+        existing_doc.filename = stored_filename
+        existing_doc.original_filename = file.filename
+        existing_doc.content_hash = content_hash
+        existing_doc.status = status
+        if status == 'pending':
+            optimize_job = enqueue_optimize_job(content_hash)
+        # Qidiruv indeksi uchun matn fon rejimida ajratiladi
+        text_job = enqueue_text_job(content_hash)
+        db.session.commit()
+
+        if deduplicated:
+            # Qulf umumiy bo'lmagan backendda (memory, bir nechta worker) fayl baribir o'chirilgan bo'lishi mumkin
+            if pdf_storage.exists(stored_filename):
+                os.remove(temp_input)
+            else:
+                pdf_storage.save(temp_input, stored_filename)
+    invalidate_document(username)
+
+    if optimize_job is not None:
+        run_processing_job(optimize_job.id)
+    if text_job is not None:
+        run_processing_job(text_job.id)
+
+    if old_filename and old_filename != stored_filename:
+        release_pdf_file(old_filename)
+
+    # Android uchun sahifa rasmlarini oldindan tayyorlab qo'yish
+    enqueue_pdf_render(stored_filename)
     
     flash(f'PDF muvaffaqiyatli yuklandi! Username: {username}', 'success')
     return redirect(url_for('admin_dashboard'))
@@ -541,30 +3830,176 @@ def upload_pdf():
 def delete_pdf(doc_id):
     document = Document.query.get_or_404(doc_id)
     
-    # PDF faylni o'chirish (agar mavjud bo'lsa)
-    if document.filename:
-        file_path = os.path.join(app.config['STATIC_PDF_FOLDER'], document.filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    filename = document.filename
     
     # Username va hujjatni o'chirish
     db.session.delete(document)
     db.session.commit()
+    invalidate_document(document.username)
+    username_filter.invalidate()
+
+    # PDF faylni o'chirish (boshqa username lar ishlatmayotgan bo'lsa)
+    if filename:
+        release_pdf_file(filename)
     
     flash('Username va hujjat muvaffaqiyatli o\'chirildi!', 'success')
     return redirect(url_for('admin_dashboard'))
 
+# Kesh statistikasi (hit/miss)
+@app.route('/admin/cache-stats')
+@login_required
+def cache_stats():
+    return jsonify({
+        'documents': document_cache.stats(),
+        'pages': page_cache.stats(),
+        'usernames': username_filter.stats(),
+    })
+
+# Prometheus metrikalari (barcha workerlar jamlangan holda)
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(404)
+
+    job_counts = dict(
+        db.session.query(ProcessingJob.status, db.func.count(ProcessingJob.id))
+        .group_by(ProcessingJob.status)
+        .all()
+    )
+    flush_metrics(force=True)
+
+    merged = collect_metrics()
+    # processing_job soni bazadan olinadi - workerlar bo'yicha yig'ilmaydi
+    for status in ('pending', 'running', 'done', 'failed'):
+        merged[('shahodatnoma_processing_jobs', (('status', status),))] = job_counts.get(status, 0)
+    return Response(render_metrics(merged), mimetype='text/plain; version=0.0.4')
+
 # QR kod yaratish (PDF yuklanmasdan ham)
 @app.route('/admin/qr/<username>')
 @login_required
 def generate_qr(username):
     document = Document.query.filter_by(username=username).first_or_404()
     url = f"{request.host_url.rstrip('/')}/{document.username}"
-    qr_code = generate_qr_code(url)
     has_pdf = document.has_pdf()
-    return render_template('qr_code.html', qr_code=qr_code, url=url, username=username, has_pdf=has_pdf)
+    return render_template('qr_code.html', url=url, username=username, has_pdf=has_pdf)
+
+# QR kod rasmi (diskda keshlanadi)
+@app.route('/admin/qr/<username>.<fmt>')
+@login_required
+def qr_image(username, fmt):
+    if fmt not in QR_FORMATS:
+        # Nuqtali username (masalan, "ali.valiyev") - oddiy QR sahifasi
+        return generate_qr(f'{username}.{fmt}')
+    document = lookup_document(username)
+    if document is None:
+        abort(404)
+
+    url = f"{request.host_url.rstrip('/')}/{document.username}"
+    path, cache_key = get_qr_code(url, parse_qr_size(request.args.get('size')), fmt)
+    response = send_file(
+        path,
+        mimetype=QR_FORMATS[fmt],
+        as_attachment=request.args.get('download') == '1',
+        download_name=f'qr-{document.username}.{fmt}',
+        etag=cache_key,
+        conditional=True,
+        max_age=86400
+    )
+    response.cache_control.private = True
+    return response
+
+# Ko'p username uchun QR kodlarni ZIP arxivda yuklab olish
+@app.route('/admin/qr/export', methods=['POST'])
+@login_required
+def export_qr_codes():
+    fmt = request.form.get('format', 'png')
+    if fmt not in QR_FORMATS:
+        fmt = 'png'
+    size = parse_qr_size(request.form.get('size'))
+
+    requested = [
+        normalize_username(name)
+        for name in request.form.get('usernames', '').replace(',', '\n').splitlines()
+        if name.strip()
+    ]
+    query = db.session.query(Document.username).order_by(Document.username)
+    if requested:
+        query = query.filter(Document.username.in_(requested))
+    usernames = [username for (username,) in query]
+    if not usernames:
+        flash('QR kod uchun username topilmadi!', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    base_url = request.host_url.rstrip('/')
+    urls = {username: f'{base_url}/{username}' for username in usernames}
+    paths = get_qr_codes(urls.values(), size, fmt)
+
+    # PNG allaqachon siqilgan - qayta siqish foydasiz
+    compression = zipfile.ZIP_DEFLATED if fmt == 'svg' else zipfile.ZIP_STORED
+    archive_file = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    with zipfile.ZipFile(archive_file, 'w', compression=compression) as archive:
+        for username, url in urls.items():
+            archive.write(paths[url], arcname=f'qr-{username}.{fmt}')
+    archive_file.seek(0)
+    return send_file(
+        archive_file,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=f'qr-kodlar-{fmt}.zip'
+    )
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Sxema migratsiyalari, eski fayllarni ko'chirish va admin sinxronlash (idempotent)."""
+    click.echo(DB_PROFILE_DESCRIPTION)
+    init_db()
+    click.echo(f"Sxema versiyasi: {get_schema_version()}/{SCHEMA_VERSION}")
+
+
+@app.cli.command('gc')
+@click.option('--dry-run', is_flag=True, help="Hech narsa o'chirmasdan faqat hisobot chiqarish")
+def gc_command(dry_run):
+    """Yetim PDF, rasm va vaqtinchalik fayllarni o'chirish, hosila fayllar keshini chegaralash."""
+    report = collect_garbage(dry_run=dry_run)
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+@app.cli.command('reindex-text')
+def reindex_text_command():
+    """Matni qidiruv indeksida yo'q PDF lar uchun matn ajratish (indeksdan oldingi yuklashlar)."""
+    content_hashes = sorted(
+        content_hash for (content_hash,) in
+        db.session.query(Document.content_hash).filter(Document.content_hash != None).distinct()  # noqa: E711
+    )
+    jobs = [job for job in map(enqueue_text_job, content_hashes) if job is not None]
+    db.session.commit()
+    for job in jobs:
+        run_processing_job(job.id)
+    # Jarayon tugashidan oldin vazifalar yakunlanishini kutish
+    shutdown_process_pools()
+    click.echo(f"Matn ajratilgan fayllar: {len(jobs)}")
+
+
+@app.cli.command('bulk-import')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('zip_path', required=False, type=click.Path(exists=True, dir_okay=False))
+def bulk_import_command(csv_path, zip_path):
+    """CSV va ZIP arxivdan username va PDF larni ommaviy import qilish."""
+    with open(csv_path, encoding='utf-8-sig') as csv_source:
+        csv_text = csv_source.read()
+    archive = zipfile.ZipFile(zip_path) if zip_path else None
+    try:
+        rows, futures = import_certificates(csv_text, archive)
+    finally:
+        if archive is not None:
+            archive.close()
+    # Jarayon tugashidan oldin siqish vazifalari yakunlanishini kutish
+    shutdown_process_pools()
+    click.echo(json.dumps(rows, ensure_ascii=False, indent=2))
 
 if __name__ == '__main__':
+    init_db()
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     app.run(debug=debug_mode, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
 
@@ -0,0 +1,146 @@
+"""
+ASGI rejimi - sertifikat topshirish paytidagi ko'p sonli sekin yuklab olishlar uchun.
+
+`/pdf/<filename>` so'rovlari event loop ichida asinxron uzatiladi: fayl bo'laklari
+thread pool da o'qiladi, sekin mijozga yuborish esa workerni band qilmaydi
+(bitta worker minglab ochiq yuklab olishni ushlab turadi). Qolgan barcha
+yo'llar (sahifalar, admin panel) o'zgarishsiz Flask ilovasiga uzatiladi.
+
+Ishga tushirish (asgiref va uvicorn kerak):
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker -w 4
+    uvicorn asgi:app --workers 4
+"""
+import asyncio
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import Headers
+
+from app import (
+    app as flask_app,
+    plan_pdf_response,
+    multipart_byteranges_parts,
+    flush_metrics,
+    shutdown_process_pools,
+)
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+PDF_PREFIX = '/pdf/'
+
+
+async def _read_chunk(pdf_file, size):
+    return await asyncio.to_thread(pdf_file.read, size)
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def _send_file_range(send, pdf_file, start, length, chunk_size, disconnected):
+    await asyncio.to_thread(pdf_file.seek, start)
+    bytes_remaining = length
+    while bytes_remaining > 0 and not disconnected.is_set():
+        data = await _read_chunk(pdf_file, min(chunk_size, bytes_remaining))
+        if not data:
+            break
+        bytes_remaining -= len(data)
+        # send() mijoz qabul qilguncha kutadi - sekin mijoz faqat shu korutinani to'xtatadi
+        await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+
+async def _send_pdf_body(send, plan, chunk_size, disconnected):
+    pdf_file = await asyncio.to_thread(open, plan.file_path, 'rb')
+    try:
+        if plan.boundary:
+            part_headers, closing, _ = multipart_byteranges_parts(
+                plan.byte_ranges, plan.file_size, plan.boundary
+            )
+            for index, (header, (start, end)) in enumerate(zip(part_headers, plan.byte_ranges)):
+                prefix = b'\r\n' + header if index else header
+                await send({'type': 'http.response.body', 'body': prefix, 'more_body': True})
+                await _send_file_range(send, pdf_file, start, end - start + 1, chunk_size, disconnected)
+            await send({'type': 'http.response.body', 'body': closing, 'more_body': True})
+        else:
+            start, end = plan.byte_ranges[0] if plan.byte_ranges else (0, plan.file_size - 1)
+            await _send_file_range(send, pdf_file, start, end - start + 1, chunk_size, disconnected)
+    finally:
+        await asyncio.to_thread(pdf_file.close)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def serve_pdf(scope, receive, send, filename):
+    """Flask dagi serve_pdf ning asinxron varianti. Fayl topilmasa None qaytaradi."""
+    request_headers = Headers([
+        (name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']
+    ])
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    force_download = query.get('download', [''])[0] == '1'
+
+    plan = await asyncio.to_thread(plan_pdf_response, filename, request_headers, force_download)
+    if plan is None:
+        return None
+    flush_metrics()
+
+    await send({
+        'type': 'http.response.start',
+        'status': plan.status,
+        'headers': [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in plan.headers.items()
+        ],
+    })
+    if plan.body and scope['method'] != 'HEAD':
+        # Mijoz uzilsa faylni oxirigacha o'qishni to'xtatish
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+        try:
+            await _send_pdf_body(send, plan, flask_app.config['PDF_STREAM_CHUNK_SIZE'], disconnected)
+        finally:
+            watcher.cancel()
+    else:
+        await send({'type': 'http.response.body', 'body': b''})
+    return plan
+
+
+class ShahodatnomaASGI:
+    """PDF uzatishni asinxron bajaradigan, qolganini Flask ga beradigan ASGI ilova."""
+
+    def __init__(self, wsgi_app):
+        if WsgiToAsgi is None:
+            raise RuntimeError("ASGI rejimi uchun asgiref kerak: pip install asgiref uvicorn")
+        self.wsgi_app = WsgiToAsgi(wsgi_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            path = scope['path']
+            filename = path[len(PDF_PREFIX):]
+            if path.startswith(PDF_PREFIX) and filename and '/' not in filename:
+                if await serve_pdf(scope, receive, send, filename) is not None:
+                    return
+
+        # Topilmagan PDF (404 sahifasi) va boshqa barcha yo'llar Flask orqali
+        await self.wsgi_app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.to_thread(shutdown_process_pools)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = ShahodatnomaASGI(flask_app)
@@ -0,0 +1,78 @@
+"""
+Ikki benchmark natijasini (benchmarks/run.py JSON) solishtirish.
+
+    python benchmarks/compare.py benchmarks/results/base.json benchmarks/results/new.json
+
+Har bir o'lchov uchun p50/p99 kechikish va throughput o'zgarishi foizda chiqariladi;
+`--threshold` dan ko'p sekinlashgan o'lchovlar bo'lsa, chiqish kodi 1 bo'ladi.
+"""
+import argparse
+import json
+import sys
+
+# Kichik qiymat yaxshi bo'lgan maydonlar; throughput da aksincha
+LATENCY_FIELDS = ('p50_ms', 'p99_ms')
+THROUGHPUT_FIELDS = ('throughput_rps',)
+
+
+def flatten(report):
+    for benchmark, cases in report['results'].items():
+        for case, stats in cases.items():
+            if isinstance(stats, dict):
+                yield f'{benchmark}:{case}', stats
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="Sekinlashish chegarasi foizda (default 10)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.candidate, encoding='utf-8') as candidate_file:
+        candidate = json.load(candidate_file)
+
+    print(f"baseline:  {baseline['meta'].get('git_revision')} {baseline['meta']['timestamp']}")
+    print(f"candidate: {candidate['meta'].get('git_revision')} {candidate['meta']['timestamp']}")
+    if baseline['meta'].get('params') != candidate['meta'].get('params'):
+        print("Diqqat: yugurish parametrlari farq qiladi, natijalar to'g'ridan-to'g'ri solishtirilmaydi")
+
+    old_cases = dict(flatten(baseline))
+    regressions = []
+    header = "o'lchov"
+    print(f"{header:48} {'p50':>9} {'p99':>9} {'rps':>9}")
+    for name, new_stats in flatten(candidate):
+        old_stats = old_cases.get(name)
+        if old_stats is None:
+            print(f'{name:48} {"yangi":>9}')
+            continue
+        cells = []
+        for field in LATENCY_FIELDS + THROUGHPUT_FIELDS:
+            delta = change(old_stats.get(field), new_stats.get(field))
+            cells.append(f'{delta:+8.1f}%' if delta is not None else f'{"-":>9}')
+            slower = delta is not None and (
+                delta > args.threshold if field in LATENCY_FIELDS else delta < -args.threshold
+            )
+            if slower:
+                regressions.append(f'{name} {field} {delta:+.1f}%')
+        print(f'{name:48} ' + ' '.join(cells))
+
+    if regressions:
+        print(f"\n{args.threshold:g}% dan ko'p sekinlashgan o'lchovlar:")
+        for regression in regressions:
+            print(f'  {regression}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
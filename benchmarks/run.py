@@ -0,0 +1,382 @@
+"""
+Ommaviy yo'llar uchun offline benchmark to'plami.
+
+Sintetik sertifikat PDF larini (turli sahifa soni va hajmda) yaratadi va
+Flask test client orqali o'lchaydi:
+  - serve_pdf: to'liq va Range yuklab olish (throughput, p50/p95/p99)
+  - user_page: Android va desktop (keshsiz va keshli)
+  - sahifa rasmlari: sovuq (render) va iliq (tayyor fayl)
+  - yuklashdagi optimizatsiya (pikepdf)
+  - QR kod yaratish (PNG/SVG, disk keshi sovuq/iliq)
+
+Natijalar JSON ga yoziladi; ikki natijani `benchmarks/compare.py` bilan solishtiring.
+
+    python benchmarks/run.py --output benchmarks/results/base.json
+    python benchmarks/run.py --quick --only serve_pdf,qr
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sintetik hujjatlar: nom -> (sahifalar soni, har sahifadagi rastr rasm tomoni piksellarda; 0 - faqat matn)
+PDF_PROFILES = {
+    'small': (1, 0),
+    'medium': (3, 600),
+    'large': (20, 1200),
+}
+ANDROID_UA = 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 Mobile Safari/537.36'
+DESKTOP_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+
+
+def summarize(samples, total_bytes=0, wall=None):
+    """Kechikishlar ro'yxatidan (soniya) statistikani hisoblash"""
+    ordered = sorted(samples)
+    wall = wall if wall is not None else sum(ordered)
+
+    def percentile(fraction):
+        return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)] * 1000
+
+    result = {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': ordered[-1] * 1000,
+        'throughput_rps': len(ordered) / wall if wall else None,
+    }
+    if total_bytes:
+        result['throughput_mb_s'] = total_bytes / wall / (1024 * 1024) if wall else None
+    return result
+
+
+def make_certificate_pdf(fitz, path, pages, image_side, seed):
+    """Sertifikatga o'xshash PDF: sarlavha, matn, ramka va (ixtiyoriy) shovqinli rastr rasm"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=842, height=595)
+        page.draw_rect(fitz.Rect(20, 20, 822, 575), color=(0.1, 0.3, 0.6), width=4)
+        page.insert_text((120, 120), 'SHAHODATNOMA', fontsize=42, color=(0.1, 0.3, 0.6))
+        page.insert_text((120, 180), f'Sertifikat #{seed}-{page_number}', fontsize=18)
+        for line in range(8):
+            words = ' '.join(rng.choice(('kurs', 'tinglovchi', 'muvaffaqiyatli', 'yakunladi', 'dastur'))
+                             for _ in range(10))
+            page.insert_text((120, 230 + line * 22), words, fontsize=12)
+        if image_side:
+            # Shovqin siqilmaydi - hajm image_side bilan deyarli chiziqli o'sadi
+            side = image_side // 4
+            pixmap = fitz.Pixmap(fitz.csRGB, side, side, rng.randbytes(side * side * 3), False)
+            page.insert_image(fitz.Rect(560, 300, 780, 520), pixmap=pixmap)
+    doc.save(path)
+    doc.close()
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def checked(response, *statuses):
+    """Kutilmagan status - o'lchov noto'g'ri yo'lni o'lchayotganini bildiradi"""
+    if response.status_code not in statuses:
+        raise BenchmarkError(f'{response.request.path}: {response.status_code}')
+    size = len(response.get_data())
+    response.close()
+    return size
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def run_concurrent(make_client, request_fn, requests_total, concurrency):
+    """request_fn(client) -> javob baytlari soni; natija: (kechikishlar, baytlar, umumiy vaqt)"""
+    clients = [make_client() for _ in range(concurrency)]
+    per_client = [requests_total // concurrency + (1 if i < requests_total % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(index):
+        samples, size = [], 0
+        for _ in range(per_client[index]):
+            started = time.perf_counter()
+            size += request_fn(clients[index])
+            samples.append(time.perf_counter() - started)
+        return samples, size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    samples = [sample for client_samples, _ in results for sample in client_samples]
+    return samples, sum(size for _, size in results), wall
+
+
+class BenchmarkEnv:
+    """Vaqtinchalik DATA_DIR va PDF papkalari bilan ajratilgan ilova"""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        os.environ['DATA_DIR'] = os.path.join(workdir, 'data')
+        # Render va optimizatsiya so'rov ichida - o'lchovlar fon jarayonlarga bog'liq bo'lmasin
+        os.environ.setdefault('RENDER_WORKERS', '0')
+        os.environ.setdefault('OPTIMIZE_WORKERS', '0')
+        sys.path.insert(0, REPO_ROOT)
+        import app as appmod
+
+        self.appmod = appmod
+        self.app = appmod.app
+        self.app.config['TESTING'] = True
+        self.app.config['STATIC_PDF_FOLDER'] = os.path.join(workdir, 'docs')
+        self.app.config['STATIC_PDF_IMAGE_FOLDER'] = os.path.join(workdir, 'docs_images')
+        os.makedirs(self.app.config['STATIC_PDF_FOLDER'], exist_ok=True)
+        os.makedirs(self.app.config['STATIC_PDF_IMAGE_FOLDER'], exist_ok=True)
+        appmod.init_db()
+        self.documents = {}
+
+    def client(self):
+        return self.app.test_client()
+
+    def add_document(self, username, source_path):
+        """PDF ni content-addressed nom bilan joylash va username ga bog'lash (HTTP yuklashsiz)"""
+        appmod = self.appmod
+        with open(source_path, 'rb') as source:
+            content_hash = appmod.hashlib.sha256(source.read()).hexdigest()
+        filename = f'{content_hash}.pdf'
+        shutil.copyfile(source_path, os.path.join(self.app.config['STATIC_PDF_FOLDER'], filename))
+        with self.app.app_context():
+            document = appmod.Document(
+                username=username, filename=filename, original_filename=os.path.basename(source_path),
+                content_hash=content_hash, status='ready',
+            )
+            appmod.db.session.add(document)
+            appmod.db.session.commit()
+        appmod.username_filter.invalidate()
+        self.documents[username] = filename
+        return filename
+
+
+def bench_serve_pdf(env, pdfs, args):
+    results = {}
+    for profile in pdfs:
+        filename = env.documents[f'bench-{profile}']
+        url = f'/pdf/{filename}'
+        file_size = os.path.getsize(os.path.join(env.app.config['STATIC_PDF_FOLDER'], filename))
+
+        def full(client):
+            return checked(client.get(url), 200)
+
+        def ranged(client, rng=random.Random(args.seed)):
+            start = rng.randrange(max(file_size - 65536, 1))
+            return checked(client.get(url, headers={'Range': f'bytes={start}-{start + 65535}'}), 206)
+
+        for name, request_fn in (('full', full), ('range_64k', ranged)):
+            samples, size, wall = run_concurrent(env.client, request_fn, args.requests, args.concurrency)
+            results[f'{profile}/{name}'] = dict(summarize(samples, size, wall), file_bytes=file_size)
+    return results
+
+
+def bench_user_page(env, pdfs, args):
+    appmod = env.appmod
+    username = 'bench-medium' if 'medium' in pdfs else f'bench-{next(iter(pdfs))}'
+    filename = env.documents[username]
+    if appmod.fitz is not None:
+        # Android sahifasi rasmlar tayyor bo'lgandagina keshlanadi
+        _, pdf_path, image_dir = appmod._render_paths(filename)
+        appmod._render_pdf_pages(pdf_path, image_dir, env.app.config['PAGE_IMAGE_BYTE_BUDGET'])
+
+    results = {}
+    for variant, user_agent in (('desktop', DESKTOP_UA), ('android', ANDROID_UA)):
+        headers = {'User-Agent': user_agent, 'Accept-Encoding': 'gzip, br'}
+
+        def hit(client):
+            return checked(client.get(f'/{username}', headers=headers), 200)
+
+        def cold(client):
+            appmod.document_cache.invalidate(username)
+            appmod.purge_cached_pages(username)
+            return hit(client)
+
+        for name, request_fn in (('cold', cold), ('warm', hit)):
+            samples, size, wall = run_concurrent(env.client, request_fn, args.requests, 1)
+            results[f'{variant}/{name}'] = summarize(samples, size, wall)
+
+        samples, size, wall = run_concurrent(env.client, hit, args.requests, args.concurrency)
+        results[f'{variant}/warm_concurrent'] = summarize(samples, size, wall)
+    return results
+
+
+def bench_render(env, pdfs, args):
+    appmod = env.appmod
+    if appmod.fitz is None:
+        return {'skipped': 'PyMuPDF o\'rnatilmagan'}
+    budget = env.app.config['PAGE_IMAGE_BYTE_BUDGET']
+    results = {}
+    client = env.client()
+    for profile in pdfs:
+        filename = env.documents[f'bench-{profile}']
+        base_name, pdf_path, image_dir = appmod._render_paths(filename)
+
+        def cold_document():
+            shutil.rmtree(image_dir, ignore_errors=True)
+            appmod._render_pdf_pages(pdf_path, image_dir, budget)
+
+        samples = timed(cold_document, max(1, args.repeat // 2))
+        results[f'{profile}/document_cold'] = dict(summarize(samples), pages=PDF_PROFILES[profile][0])
+
+        image_url = f'/img/{base_name}/1.webp'
+
+        def cold_page():
+            shutil.rmtree(image_dir, ignore_errors=True)
+            checked(client.get(image_url), 200)
+
+        def warm_page():
+            checked(client.get(image_url), 200)
+
+        results[f'{profile}/page_cold'] = summarize(timed(cold_page, args.repeat))
+        checked(client.get(image_url), 200)
+        results[f'{profile}/page_warm'] = summarize(timed(warm_page, args.repeat))
+    return results
+
+
+def bench_optimize(env, pdfs, args):
+    appmod = env.appmod
+    if appmod.pikepdf is None:
+        return {'skipped': 'pikepdf o\'rnatilmagan'}
+    results = {}
+    for profile, path in pdfs.items():
+        output = os.path.join(env.workdir, f'optimized-{profile}.pdf')
+        samples = timed(lambda: appmod.optimize_pdf(path, output), max(1, args.repeat // 2))
+        results[profile] = dict(
+            summarize(samples),
+            input_bytes=os.path.getsize(path),
+            output_bytes=os.path.getsize(output) if os.path.exists(output) else None,
+        )
+    return results
+
+
+def bench_qr(env, pdfs, args):
+    appmod = env.appmod
+    results = {}
+    rng = random.Random(args.seed)
+    for fmt in appmod.QR_FORMATS:
+        urls = [f'https://example.uz/bench-{rng.getrandbits(32):08x}' for _ in range(args.repeat)]
+        results[f'{fmt}/generate'] = summarize(
+            [sample for url in urls for sample in timed(lambda: appmod.generate_qr_code(url, fmt=fmt), 1)]
+        )
+        with env.app.app_context():
+            results[f'{fmt}/cache_cold'] = summarize(
+                [sample for url in urls for sample in timed(lambda: appmod.get_qr_code(url, fmt=fmt), 1)]
+            )
+            results[f'{fmt}/cache_warm'] = summarize(
+                [sample for url in urls for sample in timed(lambda: appmod.get_qr_code(url, fmt=fmt), 1)]
+            )
+    return results
+
+
+BENCHMARKS = {
+    'serve_pdf': bench_serve_pdf,
+    'user_page': bench_user_page,
+    'render': bench_render,
+    'optimize': bench_optimize,
+    'qr': bench_qr,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help="JSON natija fayli (default: benchmarks/results/<vaqt>.json)")
+    parser.add_argument('--only', help="Vergul bilan ajratilgan benchmarklar: " + ','.join(BENCHMARKS))
+    parser.add_argument('--requests', type=int, default=200, help="HTTP benchmarklar uchun so'rovlar soni")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=10, help="Render/optimize/QR takrorlari")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--quick', action='store_true', help="Kichik hajmdagi tezkor yugurish")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.requests, args.concurrency, args.repeat = 40, 4, 3
+
+    selected = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Noma'lum benchmark: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix='shahodatnoma-bench-')
+    try:
+        env = BenchmarkEnv(workdir)
+        if env.appmod.fitz is None:
+            parser.error("Sintetik PDF yaratish uchun PyMuPDF kerak: pip install PyMuPDF")
+
+        pdfs = {}
+        pdf_profiles = {}
+        for index, (profile, (pages, image_side)) in enumerate(PDF_PROFILES.items()):
+            path = os.path.join(workdir, f'{profile}.pdf')
+            make_certificate_pdf(env.appmod.fitz, path, pages, image_side, args.seed + index)
+            pdfs[profile] = path
+            pdf_profiles[profile] = {'pages': pages, 'image_side': image_side, 'bytes': os.path.getsize(path)}
+            env.add_document(f'bench-{profile}', path)
+
+        results = {}
+        for name in selected:
+            print(f'{name} ...', file=sys.stderr)
+            started = time.perf_counter()
+            results[name] = BENCHMARKS[name](env, pdfs, args)
+            print(f'{name}: {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    finally:
+        if 'env' in locals():
+            env.appmod.shutdown_process_pools()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': {
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'repeat': args.repeat,
+                'seed': args.seed,
+                'pdf_profiles': pdf_profiles,
+            },
+        },
+        'results': results,
+    }
+
+    output = args.output or os.path.join(
+        REPO_ROOT, 'benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as result_file:
+        json.dump(report, result_file, indent=2, ensure_ascii=False)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
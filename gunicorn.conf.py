@@ -0,0 +1,48 @@
+"""Gunicorn sozlamalari - workerlar ishga tushishidan oldin bazani bir marta migratsiya qilish.
+
+app moduli master jarayonda import qilinmaydi (aks holda workerlar ochiq DB ulanishlarini
+meros qilib oladi), shuning uchun migratsiya alohida jarayonda `flask migrate` orqali bajariladi.
+MIGRATE_ON_START=false bo'lsa o'tkazib yuboriladi (masalan, migratsiya build bosqichida bajarilganda).
+
+Workerlar metrikalarini METRICS_DIR/<pid>.json ga yozadi. Server ishga tushganda papka tozalanadi,
+to'xtagan worker fayli esa `exited-` nomiga o'tkaziladi: uning counterlari jamlanmada qoladi,
+pid qayta ishlatilsa yangi worker eski qiymatlarni ustidan yozib yubormaydi.
+"""
+import glob
+import os
+import subprocess
+import sys
+
+from dotenv import dotenv_values
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _metrics_dir():
+    # app.py dagi qiymat bilan bir xil: METRICS_DIR yoki <DATA_DIR yoki instance>/metrics
+    env = {**dotenv_values(os.path.join(BASE_DIR, '.env')), **os.environ}
+    data_directory = os.path.abspath(env.get('DATA_DIR') or os.path.join(BASE_DIR, 'instance'))
+    return env.get('METRICS_DIR') or os.path.join(data_directory, 'metrics')
+
+
+def on_starting(server):
+    for path in glob.glob(os.path.join(_metrics_dir(), '*.json*')):
+        os.remove(path)
+
+    if os.environ.get('MIGRATE_ON_START', 'true').lower() != 'true':
+        return
+    server.log.info("Database migratsiyasi: flask --app app migrate")
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'migrate'],
+        check=True,
+        cwd=BASE_DIR,
+    )
+
+
+def child_exit(server, worker):
+    metrics_dir = _metrics_dir()
+    path = os.path.join(metrics_dir, f'{worker.pid}.json')
+    try:
+        os.replace(path, os.path.join(metrics_dir, f'exited-{worker.pid}-{os.urandom(4).hex()}.json'))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,30 @@
+"""app moduli import qilinishidan oldin baza va hosila fayllarni vaqtinchalik papkaga yo'naltirish."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='shahodatnoma-tests-')
+os.environ.setdefault('CACHE_BACKEND', 'memory')
+os.environ.setdefault('GC_INTERVAL', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as app_module
+    with app_module.app.app_context():
+        app_module.init_db()
+    return app_module
+
+
+@pytest.fixture
+def db_session(app_module):
+    """Har bir test uchun app context; test qo'shgan hujjatlar oxirida o'chiriladi"""
+    with app_module.app.app_context():
+        yield app_module.db.session
+        app_module.db.session.rollback()
+        app_module.Document.query.delete()
+        app_module.db.session.commit()
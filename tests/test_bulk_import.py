@@ -0,0 +1,40 @@
+import io
+import zipfile
+
+
+def _archive(patch_member=None):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('bad.pdf', b'%PDF-1.4\n' * 100)
+    data = bytearray(buffer.getvalue())
+    if patch_member is not None:
+        patch_member(data, data.index(b'PK\x01\x02'))
+    return zipfile.ZipFile(io.BytesIO(bytes(data)))
+
+
+def _set_encrypted(data, central):
+    data[central + 8] |= 0x1
+
+
+def _set_unknown_compression(data, central):
+    data[central + 10:central + 12] = (99).to_bytes(2, 'little')
+
+
+def _import(app_module, archive):
+    rows, futures = app_module.import_certificates('username,pdf\nplain,\nbroken,bad.pdf\n', archive)
+    return {row['username']: row for row in rows}, futures
+
+
+def test_encrypted_member_fails_only_its_row(app_module, db_session):
+    rows, _ = _import(app_module, _archive(_set_encrypted))
+    assert rows['plain']['status'] == 'created'
+    assert rows['broken']['status'] == 'error'
+    assert 'encrypted' in rows['broken']['message']
+    assert app_module.Document.query.filter_by(username='plain').count() == 1
+
+
+def test_unsupported_compression_fails_only_its_row(app_module, db_session):
+    rows, _ = _import(app_module, _archive(_set_unknown_compression))
+    assert rows['plain']['status'] == 'created'
+    assert rows['broken']['status'] == 'error'
+    assert rows['broken']['message']
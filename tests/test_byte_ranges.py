@@ -0,0 +1,47 @@
+import pytest
+
+from app import MAX_BYTE_RANGES, parse_byte_ranges
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=900-', [(900, 999)]),
+    ('bytes=500-5000', [(500, 999)]),
+    ('BYTES = 0-0', [(0, 0)]),
+])
+def test_single_range(header, expected):
+    assert parse_byte_ranges(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=-0,0-9', [(0, 9)]),
+])
+def test_suffix_range(header, expected):
+    assert parse_byte_ranges(header, 1000) == expected
+
+
+def test_overlapping_and_adjacent_ranges_are_merged():
+    assert parse_byte_ranges('bytes=50-99,0-60,100-109,200-209', 1000) == [(0, 109), (200, 209)]
+    assert parse_byte_ranges('bytes=-100,850-949', 1000) == [(850, 999)]
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=5000-6000', 'bytes=-0', 'bytes=2000-,3000-'])
+def test_unsatisfiable(header):
+    assert parse_byte_ranges(header, 1000) == []
+
+
+def test_empty_file_is_unsatisfiable():
+    assert parse_byte_ranges('bytes=0-', 0) == []
+
+
+@pytest.mark.parametrize('header', ['items=0-9', 'bytes=', 'bytes=9-0', 'bytes=a-b', 'bytes=0', 'bytes=-'])
+def test_invalid_header_serves_whole_file(header):
+    assert parse_byte_ranges(header, 1000) is None
+
+
+def test_range_count_cap():
+    at_cap = ','.join(f'{index * 10}-{index * 10 + 1}' for index in range(MAX_BYTE_RANGES))
+    assert len(parse_byte_ranges(f'bytes={at_cap}', 10000)) == MAX_BYTE_RANGES
+    assert parse_byte_ranges(f'bytes={at_cap},9000-9001', 10000) is None
@@ -0,0 +1,105 @@
+import pytest
+
+from app import MemoryCacheBackend, SharedCache, SQLiteCacheBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    return MemoryCacheBackend()
+
+
+def test_set_get_delete(backend):
+    assert backend.get('a') is None
+    backend.set('a', 'one', 60)
+    assert backend.get('a') == 'one'
+    backend.set('a', 'two', 60)
+    assert backend.get('a') == 'two'
+    backend.delete('a')
+    assert backend.get('a') is None
+
+
+def test_expired_entry_is_a_miss(backend):
+    backend.set('a', 'one', 0)
+    assert backend.get('a') is None
+
+
+def test_add_only_when_missing_or_expired(backend):
+    assert backend.add('lock', 'first', 60)
+    assert not backend.add('lock', 'second', 60)
+    assert backend.get('lock') == 'first'
+
+    backend.set('stale', 'old', 0)
+    assert backend.add('stale', 'new', 60)
+    assert backend.get('stale') == 'new'
+
+
+def test_sqlite_backend_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    first, second = SQLiteCacheBackend(path), SQLiteCacheBackend(path)
+    first.set('a', 'one', 60)
+    assert second.get('a') == 'one'
+    assert not second.add('a', 'two', 60)
+
+
+def test_sqlite_invalidation_events(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    cursor = backend.latest_event_id()
+    assert backend.poll_invalidations(cursor) == ([], cursor)
+
+    backend.publish_invalidation('a')
+    backend.publish_invalidation('b')
+    keys, cursor = backend.poll_invalidations(cursor)
+    assert keys == ['a', 'b']
+    assert backend.poll_invalidations(cursor) == ([], cursor)
+    backend.compact()
+
+
+def test_shared_cache_invalidation_reaches_other_workers(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    first = SharedCache(backend, 'document', 10, 60, poll_interval=0)
+    second = SharedCache(backend, 'document', 10, 60, poll_interval=0)
+    second.get('ali')  # hodisalar kursorini boshlash
+
+    first.set('ali', {'id': 1})
+    assert second.get('ali') == {'id': 1}
+    first.invalidate('ali')
+    assert second.get('ali') is None
+
+
+def test_shared_cache_set_skips_value_read_before_invalidate(backend):
+    cache = SharedCache(backend, 'document', 10, 60, poll_interval=0)
+    generation = cache.generation('ali')
+    cache.invalidate('ali')
+    cache.set('ali', {'id': 1}, generation=generation)
+    assert cache.get('ali') is None
+
+    cache.set('ali', {'id': 2}, generation=cache.generation('ali'))
+    assert cache.get('ali') == {'id': 2}
+
+
+def test_shared_cache_set_skips_value_invalidated_by_another_worker(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    first = SharedCache(backend, 'document', 10, 60, poll_interval=0)
+    second = SharedCache(backend, 'document', 10, 60, poll_interval=0)
+
+    generation = first.generation('ali')
+    second.invalidate('ali')
+    first.set('ali', {'id': 1}, generation=generation)
+    assert first.local.get('ali') is None
+    assert backend.get(first._backend_key('ali')) is None
+
+
+def test_shared_cache_invalidate_survives_backend_outage(tmp_path, monkeypatch):
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    cache = SharedCache(backend, 'document', 10, 60, poll_interval=0)
+    cache.set('ali', {'id': 1})
+
+    def unavailable(*args):
+        raise ConnectionError('backend down')
+
+    monkeypatch.setattr(backend, 'set', unavailable)
+    monkeypatch.setattr(backend, 'delete', unavailable)
+    cache.invalidate('ali')
+    assert cache.local.get('ali') is None
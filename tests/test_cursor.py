@@ -0,0 +1,39 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from app import _decode_cursor, _encode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 17, 9, 30, 15, 123456)
+    cursor = _encode_cursor(SimpleNamespace(created_at=created_at, id=42))
+    assert _decode_cursor(cursor) == (created_at, 42)
+
+
+def test_cursor_without_microseconds():
+    created_at = datetime(2024, 1, 2, 3, 4, 5)
+    assert _decode_cursor(_encode_cursor(SimpleNamespace(created_at=created_at, id=7))) == (created_at, 7)
+
+
+def test_invalid_cursor():
+    for cursor in (None, '', 'garbage', '2024-01-01T00:00:00_x', 'nodate_5'):
+        assert _decode_cursor(cursor) is None
+
+
+def test_pages_cover_all_documents_once(app_module, db_session):
+    created_at = datetime(2024, 3, 1, 12, 0, 0)
+    for index in range(7):
+        # Bir xil vaqtli hujjatlar - tartib id bo'yicha ajratiladi
+        db_session.add(app_module.Document(username=f'page{index}', created_at=created_at))
+    db_session.add(app_module.Document(username='other', created_at=datetime(2024, 3, 2)))
+    db_session.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        documents, cursor = app_module.list_documents(after=cursor, prefix='page', limit=3)
+        seen.extend(document.username for document in documents)
+        if cursor is None:
+            break
+    assert sorted(seen) == [f'page{index}' for index in range(7)]
+    assert len(seen) == len(set(seen))
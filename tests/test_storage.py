@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from app import LocalPDFStorage, app
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'STATIC_PDF_FOLDER', str(tmp_path / 'docs'))
+    monkeypatch.setitem(app.config, 'STATIC_PDF_IMAGE_FOLDER', str(tmp_path / 'docs_images'))
+    os.makedirs(app.config['STATIC_PDF_FOLDER'])
+    return LocalPDFStorage()
+
+
+def _write(path, data=b'%PDF-1.4\n'):
+    with open(path, 'wb') as handle:
+        handle.write(data)
+    return str(path)
+
+
+def test_save_moves_file_into_storage(storage, tmp_path):
+    source = _write(tmp_path / 'upload.tmp', b'%PDF-1.4 data')
+    assert not storage.exists('abc.pdf')
+
+    storage.save(source, 'abc.pdf')
+    assert not os.path.exists(source)
+    assert storage.exists('abc.pdf')
+    with open(storage.fetch('abc.pdf'), 'rb') as handle:
+        assert handle.read() == b'%PDF-1.4 data'
+
+
+def test_save_in_place_is_a_no_op(storage):
+    path = _write(storage.local_path('abc.pdf'))
+    storage.save(path, 'abc.pdf')
+    assert storage.fetch('abc.pdf') == path
+
+
+def test_fetch_missing_file(storage):
+    assert storage.fetch('missing.pdf') is None
+    assert not storage.exists('missing.pdf')
+
+
+def test_delete_is_idempotent(storage):
+    _write(storage.local_path('abc.pdf'))
+    storage.delete('abc.pdf')
+    storage.delete('abc.pdf')
+    assert not storage.exists('abc.pdf')
+
+
+def test_list_returns_only_pdfs(storage):
+    _write(storage.local_path('a.pdf'))
+    _write(storage.local_path('b.pdf'))
+    _write(storage.local_path('b.pdf.123.tmp'))
+    os.makedirs(storage.local_path('folder.pdf'))
+
+    listed = dict(storage.list())
+    assert sorted(listed) == ['a.pdf', 'b.pdf']
+    assert listed['a.pdf'] == os.stat(storage.local_path('a.pdf')).st_mtime
+
+
+def test_release_keeps_referenced_files(app_module, db_session, storage, monkeypatch):
+    monkeypatch.setattr(app_module, 'pdf_storage', storage)
+    _write(storage.local_path('shared.pdf'))
+    _write(storage.local_path('orphan.pdf'))
+    image_dir = os.path.join(app.config['STATIC_PDF_IMAGE_FOLDER'], 'orphan')
+    os.makedirs(image_dir)
+    db_session.add(app_module.Document(username='owner', filename='shared.pdf'))
+    db_session.commit()
+
+    assert not app_module.release_pdf_file('shared.pdf')
+    assert storage.exists('shared.pdf')
+    assert app_module.release_pdf_file('orphan.pdf')
+    assert not storage.exists('orphan.pdf')
+    assert not os.path.exists(image_dir)